@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Compares validating data with a compiled Schema against comparing token
+streams, which is how every value used to be validated, and against walking
+the data for errors. Run from the root of the repository:
+
+    python benchmarks/schema_validation.py
+"""
+import os
+import sys
+from timeit import Timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from yape.json_schema import Schema, AnyString, AnyInteger
+from yape.json_schema.schema import _iter_errors
+from yape.json_schema.tokens import token_stream
+
+
+ENTITY_SCHEMA = Schema({
+    u'name': AnyString,
+    u'image': AnyString,
+    u'position': [AnyInteger, AnyInteger],
+    u'stats': {u'hp': AnyInteger, u'speed': AnyInteger},
+    u'solid': True,
+})
+
+ENTITY = {
+    u'name': u'crate',
+    u'image': u'crate.png',
+    u'position': [12, 40],
+    u'stats': {u'hp': 10, u'speed': 0},
+    u'solid': True,
+}
+
+INVALID_ENTITY = dict(ENTITY, position=[12, u'40'])
+
+
+def tokens(value):
+    return ENTITY_SCHEMA.validate_tokens(token_stream(value))[0]
+
+
+def validate(value):
+    return ENTITY_SCHEMA.validate(value)[0]
+
+
+def is_valid(value):
+    return ENTITY_SCHEMA.is_valid(value)
+
+
+def find_errors(value):
+    return not ENTITY_SCHEMA.find_errors(value)
+
+
+def walk(value):
+    return not list(_iter_errors(ENTITY_SCHEMA.definition, value, u'$'))
+
+
+def run(number=20000):
+    for label, value in (('valid', ENTITY), ('invalid', INVALID_ENTITY)):
+        for func in (tokens, validate, is_valid, find_errors, walk):
+            assert func(value) == tokens(value)
+            seconds = min(Timer(lambda: func(value)).repeat(3, number))
+            print '{0:8} {1:11} {2:8.2f} us per value'.format(
+                label, func.__name__, seconds / number * 1e6
+            )
+
+
+if __name__ == '__main__':
+    run()
@@ -3,3 +3,10 @@ from test_dispatch import *
 from test_manager import *
 from test_utils import *
 from test_components import *
+from test_replay import *
+from test_input_state import *
+from test_batch_fsm import *
+from test_entity_store import *
+from test_json_schema import *
+from test_json_stream import *
+from test_types import *
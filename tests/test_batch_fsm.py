@@ -0,0 +1,86 @@
+from unittest import TestCase
+
+from yape.fsm import FSM
+from yape.batch_fsm import BatchFSM, numpy
+
+
+# The tests are left out when numpy is not installed, since unittest can't
+# skip tests before Python 2.7
+NumpyTestCase = TestCase if numpy is not None else object
+
+
+class BatchFSMTestCase(NumpyTestCase):
+
+    def setUp(self):
+        self.transitions = [
+            {'name': 'alert', 'source': 'idle', 'destination': 'patrol'},
+            {'name': 'alert', 'source': 'patrol', 'destination': 'chase'},
+            {'name': 'scare', 'source': 'chase', 'destination': 'flee'},
+            {'name': 'calm', 'source': 'flee', 'destination': 'idle'},
+            {'name': 'calm', 'source': 'chase', 'destination': 'idle'},
+        ]
+        self.crowd = BatchFSM('idle', self.transitions, 6)
+
+    def test_initial_state(self):
+        self.assertEqual(len(self.crowd), 6)
+        self.assertTrue(self.crowd.is_state('idle').all())
+        self.assertEqual(
+            self.crowd.counts(), {'idle': 6, 'patrol': 0, 'chase': 0, 'flee': 0}
+        )
+        self.assertEqual(self.crowd.states.dtype, numpy.int8)
+
+    def test_apply_with_mask(self):
+        moved = self.crowd.apply('alert', mask=[0, 2, 4])
+        self.assertEqual(moved.tolist(), [True, False, True, False, True, False])
+        self.assertEqual(self.crowd.state_of(0), 'patrol')
+        self.assertEqual(self.crowd.state_of(1), 'idle')
+        # Destinations depend on each entity's current state
+        moved = self.crowd.apply('alert')
+        self.assertTrue(moved.all())
+        self.assertEqual(
+            [self.crowd.state_of(i) for i in range(6)],
+            ['chase', 'patrol', 'chase', 'patrol', 'chase', 'patrol']
+        )
+
+    def test_apply_with_empty_mask(self):
+        moved = self.crowd.apply('alert', mask=[])
+        self.assertFalse(moved.any())
+        self.crowd.set_state('flee', mask=[])
+        self.assertEqual(self.crowd.counts()['flee'], 0)
+
+    def test_apply_only_from_sources(self):
+        self.crowd.apply('alert', mask=self.crowd.states >= 0)
+        self.crowd.apply('alert', mask=[0])
+        moved = self.crowd.apply('scare')
+        self.assertEqual(numpy.flatnonzero(moved).tolist(), [0])
+        self.assertEqual(self.crowd.state_of(0), 'flee')
+        self.assertEqual(self.crowd.can('calm').tolist(), [True] + [False] * 5)
+
+    def test_matches_fsm(self):
+        crowd = BatchFSM('idle', self.transitions, 1)
+        machine = FSM('idle', self.transitions)
+        for name in ['alert', 'alert', 'scare', 'calm', 'alert']:
+            getattr(machine, name)()
+            self.assertTrue(crowd.apply(name)[0])
+            self.assertEqual(crowd.state_of(0), machine.state)
+
+    def test_set_state(self):
+        self.crowd.set_state('flee', mask=numpy.arange(6) < 3)
+        self.assertEqual(self.crowd.counts()['flee'], 3)
+        self.crowd.set_state('chase')
+        self.assertTrue(self.crowd.is_state('chase').all())
+
+    def test_unknown_transition(self):
+        self.assertRaises(
+            FSM.IllegalTransitionException, self.crowd.apply, 'explode'
+        )
+
+    def test_substates_inherit_transitions(self):
+        crowd = BatchFSM('alive.idle', [
+            {'name': 'alert', 'source': 'alive.idle', 'destination': 'alive.chase'},
+            {'name': 'die', 'source': 'alive', 'destination': 'dead'},
+        ], 3)
+        crowd.apply('alert', mask=[0])
+        moved = crowd.apply('die', mask=[0, 1])
+        self.assertEqual(moved.tolist(), [True, True, False])
+        self.assertEqual(crowd.state_of(2), 'alive.idle')
@@ -3,7 +3,9 @@ from unittest import TestCase
 from mock import patch, Mock
 
 from yape.manager import Manager
-from yape.components import Component, LoadableComponent
+from yape.json_schema import Schema, AnyInteger
+from yape.components import Component, LoadableComponent, ValidationCache
+from yape.types import JSONDict, FrozenJSONDict
 
 
 class PlayerComponent(Component):
@@ -90,6 +92,38 @@ class ComponentTestCase(TestCase):
         player.clean_inventory.assert_called_once_with([1, 2])
         player.clean_inventory_size.assert_called_once_with(2)
 
+    def test_is_valid_schema_errors(self):
+        class FakeComponent(Component):
+            schema = Schema({u'level': AnyInteger, u'inventory': [AnyInteger]})
+
+        player = FakeComponent(self.manager)
+        self.assertTrue(player.is_valid({u'level': 1, u'inventory': [1, 2]}))
+        self.assertFalse(player.is_valid({u'inventory': [1, u'sword']}))
+        self.assertEqual(player.errors, [
+            u"$.inventory[1]: expected AnyInteger, got u'sword'",
+            u"$.level: missing",
+        ])
+
+    def test_is_valid_cached(self):
+        fakeschema = Mock()
+        fakeschema.find_errors.return_value = [u'$.level: missing']
+
+        class FakeComponent(Component):
+            schema = fakeschema
+
+        data = FrozenJSONDict({'inventory': [1, 2]})
+        for _ in range(3):
+            player = FakeComponent(self.manager)
+            self.assertFalse(player.is_valid(data))
+            self.assertEqual(player.errors, [u'$.level: missing'])
+        fakeschema.find_errors.assert_called_once_with(data)
+        # Plain dicts aren't remembered by default
+        FakeComponent(self.manager).is_valid({'inventory': [1, 2]})
+        self.assertEqual(fakeschema.find_errors.call_count, 2)
+        FakeComponent.validation_cache = None
+        FakeComponent(self.manager).is_valid(data)
+        self.assertEqual(fakeschema.find_errors.call_count, 3)
+
     def test_is_valid_field_invalid(self):
         class FakeComponent(Component):
             clean_inventory = Mock(
@@ -120,6 +154,24 @@ class ComponentTestCase(TestCase):
         self.assertFalse(valid)
         self.assertEqual(player.errors, ['{0} did not validate'.format(data)])
 
+    def test_class_introspected_once(self):
+        class FakeComponent(Component):
+            clean_level = Mock(__name__='clean_level', return_value=True)
+
+        spec = FakeComponent.get_spec()
+        self.assertEqual(spec.validators, (('clean_level', 'level'),))
+        FakeComponent(self.manager, {'level': 1})
+        self.assertTrue(FakeComponent.get_spec() is spec)
+        player = FakeComponent(self.manager)
+        self.assertEqual(player.field_validators, [FakeComponent.clean_level])
+        # Changing the class invalidates what was cached for it
+        FakeComponent.clean_inventory = Mock(
+            __name__='clean_inventory', return_value=False
+        )
+        self.assertTrue(FakeComponent.get_spec() is not spec)
+        self.assertFalse(player.is_valid({'level': 1, 'inventory': []}))
+        self.assertEqual(player.errors, ['inventory was not valid'])
+
     @patch('yape.manager.Manager.get_font')
     @patch('yape.manager.Manager.get_sprite')
     @patch('yape.manager.Manager.get_image')
@@ -143,6 +195,186 @@ class ComponentTestCase(TestCase):
         mock_font.assert_called_once_with('font', 16)
         mock_json.assert_called_once_with('path', 'filename')
 
+    @patch('yape.manager.Manager.get_json')
+    @patch('yape.manager.Manager.get_image')
+    def test_lazy_asset_fields(self, mock_image, mock_json):
+        class LazyComponent(Component):
+            lazy_asset_fields = True
+            image_fields = ['image', 'icon']
+            json_fields = ['levels']
+
+        data = {
+            'image': 'image',
+            'levels': {'first': ('path', 'first'), 'second': ('path', 'second')},
+        }
+        component = LazyComponent(self.manager, data)
+        self.assertFalse(mock_image.called)
+        self.assertFalse(mock_json.called)
+        self.assertEqual(component.image, mock_image.return_value)
+        self.assertEqual(component.image, mock_image.return_value)
+        mock_image.assert_called_once_with('image')
+        self.assertEqual(
+            component.levels,
+            {'first': mock_json.return_value, 'second': mock_json.return_value}
+        )
+        self.assertEqual(mock_json.call_count, 2)
+        # Fields without data behave as if the component were not lazy
+        self.assertRaises(AttributeError, getattr, component, 'icon')
+        self.assertEqual(component._lazy_assets, {})
+
+    @patch('yape.manager.Manager.get_image')
+    def test_lazy_asset_field_default(self, mock_image):
+        class LazyComponent(Component):
+            lazy_asset_fields = True
+            image_fields = ['image']
+            image = None
+
+        self.assertEqual(LazyComponent(self.manager, {}).image, None)
+        component = LazyComponent(self.manager, {'image': 'image'})
+        self.assertEqual(component.image, mock_image.return_value)
+
+    @patch('yape.manager.Manager.get_image')
+    def test_dict_asset_field_of_frozen_data(self, mock_image):
+        class TileComponent(Component):
+            image_fields = ['images']
+
+        data = FrozenJSONDict({'images': {'day': 'day.png'}})
+        tile = TileComponent(self.manager, data)
+        self.assertEqual(tile.images, {'day': mock_image.return_value})
+        # The shared data is left as it was
+        self.assertEqual(data, {'images': {'day': 'day.png'}})
+
+    @patch('yape.manager.Manager.get_sprite')
+    @patch('yape.manager.Manager.get_image')
+    def test_load_many(self, mock_image, mock_sprite):
+        class TileComponent(Component):
+            image_fields = ['image']
+            sprite_fields = {'sprite': (16, 16)}
+
+            def clean_kind(self, kind):
+                return kind in ('grass', 'water')
+
+        data_list = [
+            {'kind': 'grass', 'image': 'grass.png', 'sprite': [0, 0]},
+            {'kind': 'water', 'image': 'water.png', 'sprite': [16, 0]},
+            {'kind': 'grass', 'image': 'grass.png', 'sprite': [0, 0]},
+            {'kind': 'lava', 'image': 'lava.png', 'sprite': [0, 0]},
+        ]
+        tiles = TileComponent.load_many(self.manager, data_list)
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual(
+            [tile.kind for tile in tiles[:3]], ['grass', 'water', 'grass']
+        )
+        self.assertEqual(tiles[3].errors, ['kind was not valid'])
+        self.assertEqual(
+            sorted(mock_image.call_args_list),
+            [(('grass.png',),), (('water.png',),)]
+        )
+        self.assertEqual(mock_sprite.call_count, 2)
+        mock_sprite.assert_any_call(0, 0, 16, 16)
+        self.assertTrue(tiles[0].image is tiles[2].image)
+
+    def test_load_many_init(self):
+        class CrateComponent(Component):
+            schema = Schema({u'hp': AnyInteger})
+
+            def __init__(self, manager, data=None):
+                super(CrateComponent, self).__init__(manager, data)
+                self.broken = getattr(self, 'hp', 0) <= 0
+
+        crates = CrateComponent.load_many(
+            self.manager, [{u'hp': 3}, {u'hp': 0}, {u'hp': u'3'}]
+        )
+        self.assertEqual([crate.broken for crate in crates], [False, True, True])
+        self.assertEqual(
+            crates[2].errors, [u"$.hp: expected AnyInteger, got u'3'"]
+        )
+        self.assertFalse('_batch_assets' in vars(CrateComponent))
+        spec = CrateComponent.get_spec()
+        CrateComponent.load_many(self.manager, [{u'hp': 3}])
+        self.assertTrue(CrateComponent.get_spec() is spec)
+
+
+class ValidationCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = ValidationCache(size=2, hash_content=True)
+        self.schema = Schema({u'level': AnyInteger})
+        self.schema.find_errors = Mock(wraps=self.schema.find_errors)
+
+    def test_content_not_hashed_by_default(self):
+        cache = ValidationCache(size=2)
+        cache.find_errors(self.schema, {u'level': 1})
+        cache.find_errors(self.schema, {u'level': 1})
+        self.assertEqual(self.schema.find_errors.call_count, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_equal_content(self):
+        self.assertEqual(self.cache.find_errors(self.schema, {u'level': 1}), [])
+        self.assertEqual(self.cache.find_errors(self.schema, {u'level': 1}), [])
+        self.assertEqual(self.schema.find_errors.call_count, 1)
+        self.assertEqual(
+            self.cache.find_errors(self.schema, {u'level': u'1'}),
+            [u"$.level: expected AnyInteger, got u'1'"]
+        )
+        self.assertEqual(self.schema.find_errors.call_count, 2)
+        other = Schema({u'level': AnyInteger})
+        self.cache.find_errors(other, {u'level': 1})
+        self.assertEqual(len(self.cache), 2)
+
+    def test_json_assets_by_identity(self):
+        data = FrozenJSONDict({u'level': 1})
+        self.cache.find_errors(self.schema, data)
+        self.cache.find_errors(self.schema, data)
+        self.assertEqual(self.schema.find_errors.call_count, 1)
+        self.assertEqual(len(self.cache), 1)
+        # A freed asset is forgotten
+        self.schema.find_errors.reset_mock()
+        del data
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicted_assets_not_referenced(self):
+        data = FrozenJSONDict({u'level': 1})
+        self.cache.find_errors(self.schema, data)
+        for level in range(2):
+            self.cache.find_errors(self.schema, {u'level': level})
+        self.assertEqual(self.cache._refs, {})
+
+    def test_size(self):
+        for level in range(3):
+            self.cache.find_errors(self.schema, {u'level': level})
+        self.assertEqual(len(self.cache), 2)
+        self.cache.find_errors(self.schema, {u'level': 0})
+        self.assertEqual(self.schema.find_errors.call_count, 4)
+
+    def test_mutable_assets_by_content(self):
+        data = FrozenJSONDict({u'level': 1}).thaw()
+        self.assertEqual(self.cache.find_errors(self.schema, data), [])
+        data[u'level'] = u'lots'
+        self.assertEqual(
+            self.cache.find_errors(self.schema, data),
+            [u"$.level: expected AnyInteger, got u'lots'"]
+        )
+        data = JSONDict({u'level': 1})
+        self.assertEqual(self.cache.find_errors(self.schema, data), [])
+        self.assertEqual(self.schema.find_errors.call_count, 2)
+
+    def test_non_json_containers(self):
+        schema = Schema({u'pts': [AnyInteger, AnyInteger]})
+        self.assertEqual(self.cache.find_errors(schema, {u'pts': [1, 2]}), [])
+        self.assertEqual(
+            self.cache.find_errors(schema, {u'pts': (1, 2)}),
+            [u'$.pts: expected an array, got (1, 2)']
+        )
+        self.assertEqual(len(self.cache), 1)
+
+    def test_uncacheable(self):
+        data = {u'level': object()}
+        self.cache.find_errors(self.schema, data)
+        self.cache.find_errors(self.schema, data)
+        self.assertEqual(self.schema.find_errors.call_count, 2)
+        self.assertEqual(len(self.cache), 0)
+
 
 class MapComponent(LoadableComponent):
     path = 'test_path'
@@ -1,9 +1,12 @@
+import gc
 from unittest import TestCase
 
-from mock import Mock, MagicMock, call
+from mock import Mock, MagicMock, call, patch
+import pygame
 
 from yape.fsm import FSM
-from yape.dispatch import Dispatcher, get_pygame_event_queue
+from yape.dispatch import (Dispatcher, get_pygame_event_queue,
+    set_pygame_event_filter, ALWAYS_ALLOWED_EVENT_TYPES, dispatcher)
 
 
 class DispatcherTestCase(TestCase):
@@ -239,3 +242,220 @@ class DispatcherTestCase(TestCase):
                 )
             )
 
+    def test_profiling_records_listener_times(self):
+        fsm = self.create_fsm()
+        mock_game_data = MagicMock(state=fsm)
+        mock_events = MagicMock(type=1), MagicMock(type=2), MagicMock(type=1)
+        listener_a, listener_b = Mock(), Mock()
+        # Each listener call takes one tick of the fake timer
+        timer = Mock(side_effect=range(100))
+        dispatcher = Dispatcher(Mock(return_value=mock_events))
+        dispatcher.register('main', listener_a, 1)
+        dispatcher.register('main', listener_b)
+        profiler = dispatcher.enable_profiling(frame_budget=2.5, timer=timer)
+        dispatcher.handle_events(mock_game_data)
+        stats = dict(
+            ((s.listener, s.event_type), s) for s in profiler.report()
+        )
+        self.assertEqual(stats[(listener_a, 1)].calls, 2)
+        self.assertEqual(stats[(listener_a, 1)].total_time, 2)
+        self.assertEqual(stats[(listener_a, 1)].max_time, 1)
+        self.assertEqual(stats[(listener_b, 1)].calls, 2)
+        self.assertEqual(stats[(listener_b, 2)].calls, 1)
+        self.assertEqual(stats[(listener_b, 2)].state, 'main')
+        # listener_b took 3 ticks this frame, over the 2.5 tick budget
+        self.assertEqual(profiler.over_budget(), [(listener_b, 1)])
+        self.assertEqual(profiler.frame_times, {})
+
+    def test_profiling_disabled(self):
+        fsm = self.create_fsm()
+        mock_game_data = MagicMock(state=fsm)
+        listener_a = Mock()
+        self.dispatcher.register('main', listener_a)
+        profiler = self.dispatcher.enable_profiling()
+        self.assertEqual(self.dispatcher.disable_profiling(), profiler)
+        self.assertEqual(self.dispatcher.profiler, None)
+        self.assertEqual(
+            self.dispatcher.dispatch.__func__, Dispatcher.dispatch.__func__
+        )
+        self.dispatcher.dispatch(MagicMock(type=1), mock_game_data)
+        self.assertEqual(listener_a.call_count, 1)
+        self.assertEqual(profiler.stats, {})
+
+    def test_allowed_event_types(self):
+        self.dispatcher.register('main', Mock(), 1)
+        self.dispatcher.register('main', Mock(), 2)
+        self.dispatcher.register('menu', Mock(), 3)
+        self.dispatcher.register('menu', Mock())
+        self.assertEqual(self.dispatcher.allowed_event_types('main'), set([1, 2]))
+        # An untyped listener needs every event type
+        self.assertEqual(self.dispatcher.allowed_event_types('menu'), None)
+        self.assertEqual(self.dispatcher.allowed_event_types('other'), set())
+
+    def test_handle_events_applies_filter_on_state_change(self):
+        fsm = self.create_fsm()
+        mock_game_data = MagicMock(state=fsm)
+        event_filter = Mock()
+        dispatcher = Dispatcher(Mock(return_value=[]), event_filter)
+        dispatcher.register('main', Mock(), 1)
+        dispatcher.register('menu', Mock())
+        dispatcher.handle_events(mock_game_data)
+        dispatcher.handle_events(mock_game_data)
+        self.assertEqual(event_filter.call_args_list, [call(set([1]))])
+        fsm.open_menu()
+        dispatcher.handle_events(mock_game_data)
+        self.assertEqual(event_filter.call_args, call(None))
+        fsm.start()
+        dispatcher.register('main', Mock(), 2)
+        dispatcher.handle_events(mock_game_data)
+        self.assertEqual(event_filter.call_args, call(set([1, 2])))
+        self.assertEqual(event_filter.call_count, 3)
+
+    @patch('pygame.event.set_allowed')
+    @patch('pygame.event.set_blocked')
+    def test_set_pygame_event_filter(self, mock_set_blocked, mock_set_allowed):
+        set_pygame_event_filter(None)
+        self.assertFalse(mock_set_blocked.called)
+        mock_set_allowed.assert_called_once_with(None)
+        set_pygame_event_filter(set([1]))
+        mock_set_blocked.assert_called_once_with(None)
+        allowed = set(mock_set_allowed.call_args[0][0])
+        self.assertEqual(allowed, set([1]) | ALWAYS_ALLOWED_EVENT_TYPES)
+        # The application always sees QUIT and window events
+        self.assertTrue(pygame.QUIT in allowed)
+        self.assertTrue(pygame.VIDEORESIZE in allowed)
+        if hasattr(pygame, 'WINDOWCLOSE'):
+            self.assertTrue(pygame.WINDOWCLOSE in allowed)
+            self.assertTrue(pygame.WINDOWFOCUSLOST in allowed)
+
+    def test_default_dispatcher_unfiltered(self):
+        self.assertEqual(dispatcher.event_filter, None)
+
+
+class Screen(object):
+
+    def __init__(self):
+        self.events = []
+
+    def on_event(self, event, game_data, *args, **kwargs):
+        self.events.append(event)
+
+
+class DispatcherRegistryTestCase(TestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher(get_pygame_event_queue)
+        fsm = FSM('main', [
+            {'name': 'start', 'source': 'menu', 'destination': 'main'},
+        ])
+        self.mock_game_data = MagicMock(state=fsm)
+
+    def test_bound_methods_held_weakly(self):
+        screen = Screen()
+        self.dispatcher.register('main', screen.on_event, 1)
+        self.dispatcher.register('main', screen.on_event)
+        self.assertEqual(self.dispatcher.registry_size(), 2)
+        event = MagicMock(type=1)
+        self.dispatcher.dispatch(event, self.mock_game_data)
+        # As with plain bound methods, the listener is only called once
+        self.assertEqual(screen.events, [event])
+        del screen
+        gc.collect()
+        self.assertEqual(self.dispatcher.registry_size(), 0)
+        self.assertEqual(self.dispatcher.listeners, {})
+
+    def test_functions_held_strongly(self):
+        self.dispatcher.register('main', lambda event, game_data: None)
+        gc.collect()
+        self.assertEqual(self.dispatcher.registry_size(), 1)
+
+    def test_register_bound_method_twice(self):
+        screen = Screen()
+        self.dispatcher.register('main', screen.on_event, 1)
+        self.dispatcher.register('main', screen.on_event, 1)
+        self.assertEqual(self.dispatcher.registry_size(), 1)
+        self.assertTrue(screen.on_event in self.dispatcher.listeners[('main', 1)])
+
+    def test_unregister(self):
+        screen = Screen()
+        listener = Mock()
+        self.dispatcher.register('main', screen.on_event, 1)
+        self.dispatcher.register('main', listener, 1)
+        self.assertTrue(self.dispatcher.unregister('main', screen.on_event, 1))
+        self.assertFalse(self.dispatcher.unregister('main', screen.on_event, 1))
+        self.assertFalse(self.dispatcher.unregister('menu', listener, 1))
+        self.assertEqual(
+            self.dispatcher.listeners, {('main', 1): set([listener])}
+        )
+        self.assertTrue(self.dispatcher.unregister('main', listener, 1))
+        self.assertEqual(self.dispatcher.listeners, {})
+
+    def test_unregister_owner(self):
+        screen, other_screen = Screen(), Screen()
+        self.dispatcher.register('main', screen.on_event, 1)
+        self.dispatcher.register('menu', screen.on_event)
+        self.dispatcher.register('main', other_screen.on_event, 1)
+        self.assertEqual(self.dispatcher.unregister_owner(screen), 2)
+        self.assertEqual(self.dispatcher.registry_size(), 1)
+        self.dispatcher.dispatch(MagicMock(type=1), self.mock_game_data)
+        self.assertEqual(screen.events, [])
+        self.assertEqual(len(other_screen.events), 1)
+
+    def test_dispatch_does_not_grow_registry(self):
+        self.dispatcher.dispatch(MagicMock(type=1), self.mock_game_data)
+        self.assertEqual(self.dispatcher.listeners, {})
+
+
+class DispatcherHierarchyTestCase(TestCase):
+
+    def setUp(self):
+        self.fsm = FSM('game.walking', [
+            {'name': 'talk', 'source': 'game.walking', 'destination': 'game.dialogue'},
+            {'name': 'pause', 'source': 'game', 'destination': 'menu'},
+        ])
+        self.mock_game_data = MagicMock(state=self.fsm)
+        self.dispatcher = Dispatcher(get_pygame_event_queue)
+
+    def test_parent_listeners_called_in_substates(self):
+        game_listener, walking_listener = Mock(), Mock()
+        self.dispatcher.register('game', game_listener, 1)
+        self.dispatcher.register('game.walking', walking_listener)
+        event = MagicMock(type=1)
+        self.dispatcher.dispatch(event, self.mock_game_data)
+        self.assertEqual(game_listener.call_count, 1)
+        self.assertEqual(walking_listener.call_count, 1)
+        self.fsm.talk()
+        self.dispatcher.dispatch(event, self.mock_game_data)
+        self.assertEqual(game_listener.call_count, 2)
+        self.assertEqual(walking_listener.call_count, 1)
+        self.fsm.pause()
+        self.dispatcher.dispatch(event, self.mock_game_data)
+        self.assertEqual(game_listener.call_count, 2)
+
+    def test_resolved_listeners_cached_until_registry_changes(self):
+        game_listener, dialogue_listener = Mock(), Mock()
+        self.dispatcher.register('game', game_listener, 1)
+        self.assertEqual(
+            self.dispatcher.resolve_listeners('game.dialogue', 1),
+            set([game_listener])
+        )
+        self.dispatcher.register('game.dialogue', dialogue_listener, 1)
+        self.assertEqual(
+            self.dispatcher.resolve_listeners('game.dialogue', 1),
+            set([game_listener, dialogue_listener])
+        )
+        self.dispatcher.unregister('game', game_listener, 1)
+        self.assertEqual(
+            self.dispatcher.resolve_listeners('game.dialogue', 1),
+            set([dialogue_listener])
+        )
+
+    def test_allowed_event_types_include_parents(self):
+        self.dispatcher.register('game', Mock(), 1)
+        self.dispatcher.register('game.walking', Mock(), 2)
+        self.assertEqual(
+            self.dispatcher.allowed_event_types('game.walking'), set([1, 2])
+        )
+        self.assertEqual(
+            self.dispatcher.allowed_event_types('game.dialogue'), set([1])
+        )
@@ -0,0 +1,92 @@
+from unittest import TestCase
+
+from yape.manager import Manager
+from yape.components import Component
+from yape.entity_store import EntityStore, numpy
+
+
+class Ball(Component):
+    column_fields = ['x', 'vx', 'hp']
+    hp = 10
+
+
+# The tests are left out when numpy is not installed, since unittest can't
+# skip tests before Python 2.7
+NumpyTestCase = TestCase if numpy is not None else object
+
+
+class EntityStoreTestCase(NumpyTestCase):
+
+    def setUp(self):
+        self.manager = Manager('test_path')
+        self.store = EntityStore(
+            {'x': 'float64', 'vx': 'float64', 'hp': 'int32'}, capacity=2
+        )
+        self.balls = [
+            Ball(self.manager, {'x': float(i), 'vx': 1.0, 'name': str(i)})
+            for i in xrange(3)
+        ]
+        self.store.add_many(self.balls)
+
+    def test_components_are_views(self):
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.capacity, 4)
+        self.assertEqual(self.store.column('x').tolist(), [0.0, 1.0, 2.0])
+        self.assertEqual(self.store.column('hp').tolist(), [10, 10, 10])
+        self.store.column('x')[:] += self.store.column('vx') * 2
+        self.assertEqual([ball.x for ball in self.balls], [2.0, 3.0, 4.0])
+        self.assertTrue(isinstance(self.balls[0].hp, int))
+        self.balls[1].hp = 3
+        self.assertEqual(self.store.column('hp').tolist(), [10, 3, 10])
+        self.assertEqual(self.balls[2].name, '2')
+        # Components outside of the store are unaffected
+        other = Ball(self.manager, {'x': 7.0})
+        self.assertEqual(other.x, 7.0)
+        self.assertEqual(other.hp, 10)
+        self.assertFalse(other in self.store)
+
+    def test_remove(self):
+        first, second, last = self.balls
+        self.store.remove(first)
+        self.assertEqual(first.x, 0.0)
+        self.assertFalse(first in self.store)
+        self.assertEqual(self.store.row_of(last), 0)
+        self.assertEqual(self.store.column('x').tolist(), [2.0, 1.0])
+        first.x = 5.0
+        self.assertEqual(self.store.column('x').tolist(), [2.0, 1.0])
+        self.assertRaises(ValueError, self.store.remove, first)
+        self.store.remove(second)
+        self.assertEqual(self.store.components, [last])
+        self.assertEqual(last.x, 2.0)
+
+    def test_add_invalid_value(self):
+        # The value of the last column filled doesn't fit
+        names = list(self.store.columns)
+        data = dict((name, 5) for name in names)
+        data[names[-1]] = u'fast'
+        ball = Ball(self.manager, data)
+        self.assertRaises(ValueError, self.store.add, ball)
+        self.assertFalse(ball in self.store)
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(
+            dict((name, getattr(ball, name)) for name in names), data
+        )
+
+    def test_add_changed_value(self):
+        for data in ({'x': None}, {'hp': 1.5}, {'hp': 2 ** 40}):
+            ball = Ball(self.manager, data)
+            self.assertRaises(ValueError, self.store.add, ball)
+            self.assertFalse(ball in self.store)
+        self.assertRaises(ValueError, setattr, self.balls[0], 'hp', 1.5)
+        self.assertEqual(self.balls[0].hp, 10)
+        self.store.add(Ball(self.manager, {'x': 1, 'hp': 2.0}))
+        self.assertEqual(len(self.store), 4)
+
+    def test_add_undeclared_field(self):
+        class Crate(Component):
+            column_fields = ['x', 'vx']
+
+        crate = Crate(self.manager, {'x': 1.0})
+        self.assertRaises(ValueError, self.store.add, crate)
+        self.assertFalse(crate in self.store)
+        self.assertFalse('hp' in vars(Crate))
@@ -2,7 +2,12 @@ from unittest import TestCase
 
 from mock import Mock
 
-from yape.fsm import FSM
+from StringIO import StringIO
+
+from yape.fsm import (
+    FSM, FSMDefinition, state_path, add_transition_hook,
+    remove_transition_hook, dump_traces,
+)
 
 
 class FSMTestCase(TestCase):
@@ -255,3 +260,231 @@ class FSMTestCase(TestCase):
             self.fail('IllegalCallbackException should be raised')
         except FSM.IllegalCallbackException:
             self.assertTrue(True)
+
+
+class FSMDefinitionTestCase(TestCase):
+
+    def setUp(self):
+        self.door_transitions = [
+            {'name': 'open', 'source': 'closed', 'destination': 'opened'},
+            {'name': 'close', 'source': 'opened', 'destination': 'closed'},
+            {'name': 'lock', 'source': 'closed', 'destination': 'locked'},
+            {'name': 'unlock', 'source': 'locked', 'destination': 'closed'},
+        ]
+        self.open_callback = Mock(return_value='opened!')
+        self.before_lock_callback = Mock(return_value=False)
+        self.definition = FSMDefinition(self.door_transitions, {
+            'on_open': self.open_callback,
+            'on_before_lock': self.before_lock_callback,
+        })
+
+    def test_machines_share_definition(self):
+        door_a = self.definition('opened')
+        door_b = self.definition('closed')
+        self.assertTrue(type(door_a) is type(door_b))
+        self.assertFalse(hasattr(door_a, '__dict__'))
+        self.assertTrue(door_a.transitions is door_b.transitions)
+        self.assertEqual(
+            door_a.possible_states, set(['opened', 'closed', 'locked'])
+        )
+        self.assertEqual(door_a.transitions, FSM(
+            'opened', self.door_transitions
+        ).transitions)
+
+    def test_transitions(self):
+        door_a = self.definition('opened')
+        door_b = self.definition('opened')
+        door_a.close()
+        self.assertTrue(door_a.is_state('closed'))
+        self.assertTrue(door_b.is_state('opened'))
+        self.assertTrue(door_a.can('open'))
+        self.assertFalse(door_b.can('open'))
+        self.assertEqual(door_a.open(1, key=2), 'opened!')
+        self.open_callback.assert_called_once_with(1, key=2)
+        door_a.close()
+        door_a.lock()
+        self.assertTrue(door_a.is_state('closed'))
+        self.assertRaises(FSM.IllegalTransitionException, door_b.unlock)
+
+    def test_invalid_definitions(self):
+        self.assertRaises(FSM.IllegalNameException, FSMDefinition, [
+            {'name': 'definition', 'source': 'a', 'destination': 'b'},
+        ])
+        self.assertRaises(FSM.IllegalNameException, FSMDefinition, [
+            {'name': 'transitions', 'source': 'a', 'destination': 'b'},
+        ])
+        self.assertRaises(
+            FSM.IllegalCallbackException, FSMDefinition,
+            self.door_transitions, {'on_knock': Mock()}
+        )
+
+    def test_graph_analysis(self):
+        self.assertEqual(self.definition.unreachable_states, set())
+        self.assertEqual(self.definition.dead_states, set())
+        definition = FSMDefinition(self.door_transitions + [
+            {'name': 'bash', 'source': 'locked', 'destination': 'bashed'},
+            {'name': 'repair', 'source': 'broken', 'destination': 'closed'},
+        ], initial='opened')
+        self.assertEqual(definition.unreachable_states, set(['broken']))
+        self.assertEqual(definition.dead_states, set(['bashed']))
+        self.assertEqual(
+            definition.reachable_from('locked'),
+            set(['locked', 'closed', 'opened', 'bashed'])
+        )
+        self.assertTrue(definition().is_state('opened'))
+
+
+class FSMTransitionTestCase(TestCase):
+
+    def setUp(self):
+        self.machine = FSM('idle', [
+            {'name': 'alert', 'source': 'idle', 'destination': 'patrol'},
+            {'name': 'alert', 'source': 'patrol', 'destination': 'chase'},
+            {'name': 'calm', 'source': 'chase', 'destination': 'idle'},
+        ])
+
+    def test_destination_depends_on_source(self):
+        self.machine.alert()
+        self.assertTrue(self.machine.is_state('patrol'))
+        self.machine.alert()
+        self.assertTrue(self.machine.is_state('chase'))
+        self.assertRaises(FSM.IllegalTransitionException, self.machine.alert)
+
+    def test_return_values(self):
+        # Without any callbacks, transitions return None
+        self.assertEqual(self.machine.alert(), None)
+        self.machine.add_callback('on_calm', Mock(return_value='calmed'))
+        # With callbacks, but none for this transition, they return True
+        self.assertEqual(self.machine.alert(), True)
+        self.assertEqual(self.machine.calm(), 'calmed')
+        self.machine.add_callback('on_before_alert', Mock(return_value=False))
+        self.assertEqual(self.machine.alert(), None)
+        self.assertTrue(self.machine.is_state('idle'))
+
+    def test_add_transition_after_callbacks(self):
+        on_flee = Mock(return_value='fled')
+        self.machine.add_transition(
+            {'name': 'flee', 'source': 'idle', 'destination': 'hiding'}
+        )
+        self.machine.add_callback('on_flee', on_flee)
+        self.machine.add_transition(
+            {'name': 'flee', 'source': 'chase', 'destination': 'hiding'}
+        )
+        self.assertEqual(self.machine.flee(), 'fled')
+        self.machine.state = 'chase'
+        self.assertEqual(self.machine.flee(), 'fled')
+        self.assertEqual(on_flee.call_count, 2)
+
+
+class HierarchicalFSMTestCase(TestCase):
+
+    def setUp(self):
+        self.transitions = [
+            {'name': 'start', 'source': 'menu', 'destination': 'game.walking'},
+            {'name': 'pause', 'source': 'game', 'destination': 'menu'},
+            {'name': 'talk', 'source': 'game.walking', 'destination': 'game.dialogue'},
+            {'name': 'leave', 'source': 'game.dialogue', 'destination': 'game.walking'},
+            {'name': 'pause', 'source': 'game.dialogue', 'destination': 'game.walking'},
+        ]
+        self.machine = FSM('menu', self.transitions)
+
+    def test_state_path(self):
+        self.assertEqual(
+            state_path('game.menu.options'),
+            ('game.menu.options', 'game.menu', 'game')
+        )
+        self.assertEqual(state_path('game'), ('game',))
+        self.assertEqual(state_path(None), (None,))
+
+    def test_substates_inherit_transitions(self):
+        self.machine.start()
+        self.assertTrue(self.machine.is_state('game.walking'))
+        self.assertTrue(self.machine.is_in('game'))
+        self.assertFalse(self.machine.is_in('menu'))
+        self.assertTrue(self.machine.can('pause'))
+        self.machine.pause()
+        self.assertTrue(self.machine.is_state('menu'))
+        self.assertFalse(self.machine.can('pause'))
+        self.assertRaises(FSM.IllegalTransitionException, self.machine.pause)
+
+    def test_substate_overrides_parent_transition(self):
+        self.machine.start()
+        self.machine.talk()
+        self.machine.pause()
+        self.assertTrue(self.machine.is_state('game.walking'))
+
+    def test_definition_analysis(self):
+        definition = FSMDefinition(self.transitions, initial='menu')
+        self.assertEqual(definition.unreachable_states, set())
+        self.assertEqual(definition.dead_states, set())
+        machine = definition()
+        machine.start()
+        machine.pause()
+        self.assertTrue(machine.is_state('menu'))
+
+
+class FSMTraceTestCase(TestCase):
+
+    def setUp(self):
+        self.machine = FSM('idle', [
+            {'name': 'alert', 'source': 'idle', 'destination': 'patrol'},
+            {'name': 'calm', 'source': 'patrol', 'destination': 'idle'},
+        ])
+
+    def test_trace_is_a_ring_buffer(self):
+        self.assertEqual(self.machine.trace, None)
+        trace = self.machine.enable_trace(3, name='guard')
+        for _ in xrange(3):
+            self.machine.alert()
+            self.machine.calm()
+        self.assertEqual(len(trace), 3)
+        records = list(trace)
+        self.assertEqual(
+            [(source, name, destination)
+             for _, source, name, destination, _ in records],
+            [('patrol', 'calm', 'idle'), ('idle', 'alert', 'patrol'),
+             ('patrol', 'calm', 'idle')]
+        )
+        timestamps = [record[0] for record in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertTrue(all(record[4] >= 0 for record in records))
+        stream = StringIO()
+        dump_traces(stream)
+        self.assertTrue('Transition trace guard' in stream.getvalue())
+        self.assertTrue('idle -> alert -> patrol' in stream.getvalue())
+        self.machine.disable_trace()
+        self.machine.alert()
+        self.assertEqual(len(trace), 3)
+        self.assertEqual(self.machine.trace, None)
+
+    def test_trace_survives_new_callbacks(self):
+        trace = self.machine.enable_trace()
+        on_before_alert = Mock(return_value=False)
+        self.machine.add_callback('on_before_alert', on_before_alert)
+        self.machine.alert()
+        self.assertEqual(list(trace)[0][1:4], ('idle', 'alert', 'idle'))
+
+    def test_trace_records_crashing_transition(self):
+        trace = self.machine.enable_trace()
+        on_alert = Mock(side_effect=ValueError)
+        self.machine.add_callback('on_alert', on_alert)
+        self.assertRaises(ValueError, self.machine.alert)
+        self.assertEqual(list(trace)[0][1:4], ('idle', 'alert', 'patrol'))
+
+    def test_transition_hooks(self):
+        hook = Mock()
+        add_transition_hook(hook)
+        try:
+            self.machine.alert()
+            definition = FSMDefinition([
+                {'name': 'start', 'source': 'menu', 'destination': 'game'},
+            ])
+            machine = definition('menu')
+            machine.start()
+        finally:
+            remove_transition_hook(hook)
+        self.machine.calm()
+        self.assertEqual(hook.call_args_list, [
+            ((self.machine, 'idle', 'alert', 'patrol'),),
+            ((machine, 'menu', 'start', 'game'),),
+        ])
@@ -0,0 +1,97 @@
+from unittest import TestCase
+
+import pygame
+from mock import Mock, MagicMock
+
+from yape.fsm import FSM
+from yape.dispatch import Dispatcher
+from yape.input_state import InputState
+
+
+def key_event(event_type, key):
+    return pygame.event.Event(event_type, key=key, mod=0)
+
+
+def button_event(event_type, button, pos):
+    return pygame.event.Event(event_type, button=button, pos=pos)
+
+
+class InputStateTestCase(TestCase):
+
+    def setUp(self):
+        self.input_state = InputState()
+
+    def frame(self, *events):
+        self.input_state.begin_frame()
+        for event in events:
+            self.input_state.update(event)
+
+    def test_key_edges(self):
+        self.frame(key_event(pygame.KEYDOWN, pygame.K_LEFT))
+        self.assertTrue(self.input_state.is_key_down(pygame.K_LEFT))
+        self.assertTrue(self.input_state.was_key_pressed(pygame.K_LEFT))
+        self.assertFalse(self.input_state.is_key_down(pygame.K_RIGHT))
+        # Key repeat does not count as a new press
+        self.frame(key_event(pygame.KEYDOWN, pygame.K_LEFT))
+        self.assertTrue(self.input_state.is_key_down(pygame.K_LEFT))
+        self.assertFalse(self.input_state.was_key_pressed(pygame.K_LEFT))
+        self.frame(key_event(pygame.KEYUP, pygame.K_LEFT))
+        self.assertFalse(self.input_state.is_key_down(pygame.K_LEFT))
+        self.assertTrue(self.input_state.was_key_released(pygame.K_LEFT))
+        self.frame()
+        self.assertFalse(self.input_state.was_key_released(pygame.K_LEFT))
+
+    def test_key_tapped_within_frame(self):
+        self.frame(
+            key_event(pygame.KEYDOWN, pygame.K_SPACE),
+            key_event(pygame.KEYUP, pygame.K_SPACE),
+        )
+        self.assertFalse(self.input_state.is_key_down(pygame.K_SPACE))
+        self.assertTrue(self.input_state.was_key_pressed(pygame.K_SPACE))
+        self.assertTrue(self.input_state.was_key_released(pygame.K_SPACE))
+
+    def test_mouse(self):
+        self.frame(
+            pygame.event.Event(pygame.MOUSEMOTION, pos=(5, 6), rel=(1, 1)),
+            button_event(pygame.MOUSEBUTTONDOWN, 1, (7, 8)),
+        )
+        self.assertEqual(self.input_state.mouse_pos, (7, 8))
+        self.assertTrue(self.input_state.is_button_down(1))
+        self.assertTrue(self.input_state.was_button_pressed(1))
+        self.assertFalse(self.input_state.is_button_down(3))
+        self.frame(button_event(pygame.MOUSEBUTTONUP, 1, (9, 9)))
+        self.assertFalse(self.input_state.is_button_down(1))
+        self.assertTrue(self.input_state.was_button_released(1))
+        self.assertEqual(self.input_state.mouse_pos, (9, 9))
+
+    def test_other_events_ignored(self):
+        self.frame(pygame.event.Event(pygame.QUIT))
+        self.assertEqual(self.input_state.keys_down, 0)
+        self.assertEqual(self.input_state.buttons_down, 0)
+
+
+class DispatcherInputStateTestCase(TestCase):
+
+    def test_handle_events_updates_input_state(self):
+        fsm = FSM('main', [
+            {'name': 'start', 'source': 'menu', 'destination': 'main'},
+        ])
+        mock_game_data = MagicMock(state=fsm)
+        input_state = InputState()
+        events = [key_event(pygame.KEYDOWN, pygame.K_UP)]
+        event_filter = Mock()
+        dispatcher = Dispatcher(
+            Mock(return_value=events), event_filter, input_state
+        )
+        listener = Mock()
+        dispatcher.register('main', listener, pygame.QUIT)
+        dispatcher.handle_events(mock_game_data)
+        self.assertTrue(input_state.was_key_pressed(pygame.K_UP))
+        self.assertFalse(listener.called)
+        allowed = event_filter.call_args[0][0]
+        self.assertTrue(input_state.event_types.issubset(allowed))
+        self.assertTrue(pygame.QUIT in allowed)
+        # Replacing the input state reapplies the filter
+        dispatcher.input_state = None
+        dispatcher.handle_events(mock_game_data)
+        self.assertEqual(event_filter.call_args[0][0], set([pygame.QUIT]))
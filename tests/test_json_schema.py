@@ -0,0 +1,368 @@
+import pickle
+from array import array
+from unittest import TestCase
+
+from yape.json_schema import (
+    Schema, SchemaCollection, AnyString, AnyInteger, MetaToken,
+)
+from yape.json_schema import schema as schema_module
+from yape.json_schema.schema import SchemaCollectionType, _iter_errors
+from yape.json_schema.compiled import compile_validator
+from yape.json_schema.tokens import (
+    BadInputValue, DecimalToken, IntegerToken, MappingToken, SequenceToken, StringToken, ValueToken,
+    token_stream,
+)
+from yape.types import JSONDict, JSONList
+
+from mock import patch
+
+
+class EvenInteger(MetaToken):
+    matching_token_types = (IntegerToken,)
+
+    def predicate(cls, token):
+        return token.value % 2 == 0
+
+
+class AnySequence(MetaToken):
+    matching_token_types = (SequenceToken,)
+
+
+SCHEMAS = [
+    AnyString,
+    AnyInteger,
+    EvenInteger,
+    None,
+    u'name',
+    3,
+    [u'hello', {u'world': AnyString}],
+    [AnyInteger, AnySequence, [None, True]],
+    {u'name': AnyString, u'size': [AnyInteger, EvenInteger], u'solid': True},
+    {u'a': {u'b': [1.5, u'c']}, u'd': []},
+    [AnyInteger, AnyInteger],
+]
+
+VALUES = [
+    u'a', 'a', 1, 2, 3L, 1.0, 1.5, True, False, None, u'name', [], {},
+    [u'hello', {u'world': u'Hey'}],
+    [u'hello', {u'world': 123}],
+    [u'hello', {u'world': u'Hey', u'x': 1}],
+    [u'hello', {u'world': u'Hey'}, 3],
+    [u'hello'],
+    [3, [1], [None, True]],
+    [3, [], [1, u'a']],
+    [3, {}, [None, True]],
+    [[u'hello', {}]],
+    JSONList([u'hello', JSONDict({u'world': u'Hey'})]),
+    {u'name': u'crate', u'size': [1, 2], u'solid': True},
+    {u'name': u'crate', u'size': [1, 3], u'solid': True},
+    {u'name': u'crate', u'size': [1, 2], u'solid': None},
+    {u'name': u'crate', u'size': [1, 2]},
+    {u'name': u'crate', u'size': [1, 2], u'solid': True, u'z': 0},
+    {u'aaa': 1, u'name': u'crate', u'size': [1, 2], u'solid': True},
+    {u'a': {u'b': [1.5, u'c']}, u'd': []},
+    {u'a': {u'b': [1.5, u'c']}, u'd': [1]},
+    {u'a': {u'b': [1.5, u'd']}, u'd': []},
+    {u'a': {u'b': [1, u'c']}, u'd': []},
+    {u'a': [u'b', [1.5, u'c']], u'd': []},
+    [1, 2L], [1, 1.5], [1, 2, 3],
+]
+
+
+def token_result(schema, value):
+    """Validates `value` by comparing tokens only"""
+    try:
+        return schema.validate_tokens(token_stream(value))[0]
+    except Exception as e:
+        return type(e)
+
+
+class CompiledSchemaTestCase(TestCase):
+
+    def test_results_match_token_comparison(self):
+        for definition in SCHEMAS:
+            schema = Schema(definition)
+            validator = compile_validator(definition)
+            for value in VALUES:
+                expected = token_result(schema, value)
+                verdict = validator(value)
+                if verdict is not None:
+                    self.assertEqual(
+                        verdict, expected, (definition, value, verdict)
+                    )
+                try:
+                    valid = schema.validate(value)[0]
+                except Exception as e:
+                    valid = type(e)
+                self.assertEqual(valid, expected, (definition, value))
+                self.assertEqual(
+                    schema.is_valid(value), not schema.find_errors(value),
+                    (definition, value)
+                )
+
+    def test_exact_shapes_need_no_tokens(self):
+        validator = compile_validator(SCHEMAS[8])
+        self.assertTrue(validator(VALUES[23]))
+        self.assertFalse(validator(VALUES[24]))
+        self.assertEqual(validator(VALUES[27]), None)
+        self.assertTrue(compile_validator(EvenInteger)(4))
+        self.assertFalse(compile_validator(EvenInteger)(5))
+
+    def test_is_valid_checks_structure(self):
+        schema = Schema({u'b': 1})
+        self.assertFalse(schema.validate({u'a': 0, u'b': 1})[0])
+        self.assertTrue(schema.is_valid({u'a': 0, u'b': 1}))
+        self.assertTrue(schema.validate({})[0])
+        self.assertFalse(schema.is_valid({}))
+
+    def test_checker_matches_find_errors(self):
+        for definition in SCHEMAS:
+            schema = Schema(definition)
+            for value in VALUES + [(1, 2), object(), {u'name': (u'a',)}]:
+                errors = list(_iter_errors(definition, value, u'$'))
+                self.assertEqual(
+                    schema.checker(value), not errors, (definition, value)
+                )
+
+    def test_failures_report_tokens(self):
+        schema = Schema([u'hello', AnyInteger])
+        valid, expected, got = schema.validate([u'hello', u'world'])
+        self.assertFalse(valid)
+        self.assertTrue(expected is AnyInteger)
+        self.assertEqual(got.value, u'world')
+
+    def test_pickle(self):
+        schema = pickle.loads(pickle.dumps(Schema(SCHEMAS[8])))
+        self.assertEqual(schema.definition, SCHEMAS[8])
+        self.assertTrue(schema.is_valid(VALUES[23]))
+        self.assertFalse(schema.is_valid(VALUES[24]))
+
+    def test_match_to_schema(self):
+        class Messages(SchemaCollection):
+            greeting = [u'hello', {u'world': AnyString}]
+            count = [u'hello', {u'world': AnyInteger}]
+
+        self.assertEqual(
+            Messages.match_to_schema([u'hello', {u'world': u'Hey'}]),
+            'greeting'
+        )
+        self.assertEqual(
+            Messages.match_to_schema([u'hello', {u'world': 1}]), 'count'
+        )
+        self.assertEqual(Messages.match_to_schema([u'bye']), None)
+
+
+class FindErrorsTestCase(TestCase):
+
+    def setUp(self):
+        self.schema = Schema({
+            u'name': AnyString,
+            u'kind': u'tile',
+            u'solid': True,
+            u'position': [AnyInteger, AnyInteger],
+            u'items': [{u'name': AnyString}],
+        })
+
+    def test_valid(self):
+        self.assertEqual(self.schema.find_errors({
+            u'name': u'crate', u'kind': u'tile', u'solid': True,
+            u'position': [1, 2], u'items': [], u'extra': None,
+        }), [])
+
+    def test_every_error_with_its_path(self):
+        errors = self.schema.find_errors({
+            u'name': 3, u'kind': u'item', u'solid': False,
+            u'position': [1],
+            u'items': [{u'name': u'key'}, {}, {u'name': []}, 4],
+        })
+        self.assertEqual(errors, [
+            u"$.items[1].name: missing",
+            u"$.items[2].name: expected AnyString, got an array",
+            u"$.items[3]: expected an object, got 4",
+            u"$.kind: expected u'tile', got u'item'",
+            u"$.name: expected AnyString, got 3",
+            u"$.position: expected 2 items, got 1",
+            u"$.solid: expected True, got False",
+        ])
+
+    def test_max_errors(self):
+        self.assertEqual(
+            self.schema.find_errors([], max_errors=1),
+            [u"$: expected an object, got an array"]
+        )
+        errors = self.schema.find_errors({u'items': [{}] * 1000}, max_errors=3)
+        self.assertEqual(len(errors), 3)
+
+
+class AnyNumber(MetaToken):
+    matching_token_types = (IntegerToken, DecimalToken)
+
+
+class HomogeneousArrayTestCase(TestCase):
+
+    def setUp(self):
+        self.schema = Schema({
+            u'layers': [{u'data': [AnyInteger]}],
+            u'heights': [AnyNumber],
+            u'names': [AnyString],
+        })
+        self.level = {
+            u'layers': [{u'data': [1, 2, 3]}, {u'data': []}],
+            u'heights': [1, 2.5],
+            u'names': [u'grass', 'rock'],
+        }
+
+    def test_typed_arrays(self):
+        typed_arrays = {}
+        self.assertEqual(self.schema.find_errors(self.level,
+            typed_arrays=typed_arrays), [])
+        self.assertEqual(
+            sorted(typed_arrays),
+            [u'$.heights', u'$.layers[0].data', u'$.layers[1].data']
+        )
+        data = typed_arrays[u'$.layers[0].data']
+        self.assertEqual(list(data), [1, 2, 3])
+        self.assertEqual(list(typed_arrays[u'$.heights']), [1.0, 2.5])
+        if schema_module.numpy is not None:
+            self.assertEqual(data.dtype, schema_module.numpy.int64)
+
+    @patch('yape.json_schema.schema.numpy', None)
+    def test_typed_arrays_without_numpy(self):
+        typed_arrays = {}
+        self.schema.find_errors(self.level, typed_arrays=typed_arrays)
+        data = typed_arrays[u'$.layers[0].data']
+        self.assertEqual(data, array('l', [1, 2, 3]))
+        self.assertEqual(typed_arrays[u'$.heights'], array('d', [1.0, 2.5]))
+
+    def test_mixed_array(self):
+        self.level[u'layers'][0][u'data'] = [1, u'2', 3, None, 2 ** 70]
+        typed_arrays = {}
+        self.assertEqual(self.schema.find_errors(self.level,
+            typed_arrays=typed_arrays), [
+            u"$.layers[0].data[1]: expected AnyInteger, got u'2'",
+            u"$.layers[0].data[3]: expected AnyInteger, got None",
+        ])
+        self.assertFalse(u'$.layers[0].data' in typed_arrays)
+        # Numbers too big for the typed array are valid but not converted
+        self.level[u'layers'][0][u'data'] = [1, 2 ** 70]
+        typed_arrays = {}
+        self.assertEqual(self.schema.find_errors(self.level,
+            typed_arrays=typed_arrays), [])
+        self.assertFalse(u'$.layers[0].data' in typed_arrays)
+
+    def test_compiled_fixed_size_layer(self):
+        schema = Schema([AnyInteger] * 4)
+        self.assertTrue(schema.validator([1, 2, 3, 4L]))
+        self.assertFalse(schema.validator([1, 2, u'3', 4]))
+        self.assertEqual(schema.validator([1, 2, 3]), None)
+        self.assertTrue(schema.validate([1, 2, 3])[0])
+        self.assertFalse(schema.is_valid([1, 2, 3]))
+
+
+class ContextPathTestCase(TestCase):
+
+    def test_equal_contexts_share_a_path(self):
+        first = list(token_stream([{u'a': 1, u'b': [2]}]))
+        second = list(token_stream([[u'a', 1, [2]]]))
+        self.assertEqual(
+            [token.context_path() for token in first[:3]],
+            [token.context_path() for token in second[:3]]
+        )
+        # Tokens compare by the depth of their context, whatever its classes
+        self.assertEqual(first[1], second[1])
+        self.assertNotEqual(first[0], first[1])
+        # Entries of a mapping share their key and value context tokens
+        self.assertTrue(first[2] is first[6])
+        self.assertTrue(first[3].context is first[7].context)
+        self.assertEqual(first[3].value, u'a')
+        self.assertEqual(first[7].value, u'b')
+
+    def test_replaced_context(self):
+        root = SequenceToken()
+        token = StringToken(u'a', MappingToken(root))
+        other = StringToken(u'a', MappingToken())
+        self.assertNotEqual(token, other)
+        other.context.context = SequenceToken()
+        self.assertEqual(token, other)
+        other.context = None
+        self.assertNotEqual(token, other)
+        self.assertEqual(other, StringToken(u'a'))
+
+    def test_value_contexts(self):
+        # Value tokens compare their values as contexts too, so they aren't
+        # interned
+        first = ValueToken(u'a', ValueToken(123))
+        second = ValueToken(u'a', ValueToken(321))
+        self.assertEqual(first.context_path(), None)
+        self.assertNotEqual(first, second)
+        second.context.value = 123
+        self.assertEqual(first, second)
+
+
+class Messages(SchemaCollection):
+    move = [u'move', AnyInteger, AnyInteger]
+    jump = [u'jump', AnyInteger]
+    say = [u'say', AnyString]
+    say_to = [u'say', AnyString, AnyString]
+    even = [u'move', EvenInteger, 1]
+    shout = [AnyString, u'!']
+    quit = [u'quit']
+    anything = [None]
+    entity = {u'name': AnyString, u'kind': u'tile'}
+    item = {u'name': AnyString, u'kind': u'item'}
+    number = 3
+
+
+def outcome(func, *args):
+    """Returns the result of the call, or the type of exception it raised"""
+    try:
+        return func(*args)
+    except Exception as e:
+        return type(e)
+
+
+def scan(collection, value):
+    """Matches `value` by trying every schema in turn"""
+    for schema_name, schema in collection.schemas.iteritems():
+        if schema.validate_tokens(token_stream(value))[0]:
+            return schema_name
+
+
+class SchemaIndexTestCase(TestCase):
+
+    def test_matches_scan(self):
+        values = VALUES + [
+            [u'move', 1, 2], [u'move', 2, 1], [u'move', 1], [u'jump', 1],
+            [u'say', u'hi'], [u'say', u'hi', u'you'], [u'say', 1],
+            [u'hey', u'!'], [u'quit'], [u'quit', 1], [1], 3, 4, u'move',
+            {u'name': u'door', u'kind': u'tile'},
+            {u'name': u'key', u'kind': u'item'},
+            {u'name': u'key', u'kind': u'npc'},
+        ]
+        for value in values:
+            self.assertEqual(
+                outcome(Messages.match_to_schema, value),
+                outcome(scan, Messages, value),
+                value
+            )
+
+    def test_candidates(self):
+        index = Messages._schema_index
+        candidates = index.candidates(list(token_stream([u'jump', 1])))
+        self.assertEqual(
+            sorted(candidates), ['anything', 'jump', 'number']
+        )
+        # A stream that ends before the tested position rules nothing out
+        self.assertEqual(
+            sorted(index.candidates(list(token_stream([])))),
+            sorted(Messages.schemas)
+        )
+
+    def test_unsupported_input(self):
+        for value in [(1, 2), [object()], [u'move', 1, object()],
+                      [u'quit', object()], {u'name': object()}]:
+            self.assertRaises(BadInputValue, Messages.match_to_schema, value)
+
+    def test_empty_collection(self):
+        Empty = SchemaCollectionType('Empty', (SchemaCollection,), {})
+        self.assertEqual(Empty.match_to_schema([u'move']), None)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import json
+from io import BytesIO
+
+from unittest import TestCase
+
+from yape.json_schema import Schema, AnyInteger
+from yape.json_stream import (
+    JSONEventParser, JSONStreamError, InvalidItemError, iter_items, load,
+)
+from yape.types import JSONDict, JSONList
+
+
+DOCUMENTS = [
+    u'{}', u'[]', u'0', u'-1.5e3', u'"text"', u'true', u'false', u'null',
+    u'[1, [2, [3, []]], {"a": {"b": null}}]',
+    u'{"name": "café 中", "escaped": "\\"\\\\\\n\\u00e9\\ud83d\\ude00"}',
+    u' { "tiles" : [ { "x" : 12345678901234 , "y" : 0.25 } ] } \n',
+]
+
+
+class JSONStreamTestCase(TestCase):
+
+    def test_load_matches_json(self):
+        for document in DOCUMENTS:
+            text = document.encode('utf-8')
+            # Tiny chunks split tokens and multibyte characters
+            for chunk_size in (1, 2, 3, 64):
+                self.assertEqual(
+                    load(BytesIO(text), chunk_size), json.loads(text), text
+                )
+
+    def test_load_containers(self):
+        self.assertTrue(isinstance(load(BytesIO('{"a": [1]}')), JSONDict))
+        self.assertTrue(isinstance(load(BytesIO('[{"a": 1}]')), JSONList))
+
+    def test_invalid(self):
+        documents = [
+            '', '[1,', '{"a" 1}', '[1 2]', '[1]x', 'tru', '"abc', '[-]',
+            '{"a": 1,}', '[1.]', '"\\x"', '{1: 2}', ']',
+        ]
+        for document in documents:
+            for chunk_size in (1, 64):
+                self.assertRaises(
+                    JSONStreamError, load, BytesIO(document), chunk_size
+                )
+
+    def test_events_and_paths(self):
+        parser = JSONEventParser(BytesIO('{"a": [1, {"b": true}], "c": null}'))
+        events = [(event, value, list(parser.path)) for event, value in parser]
+        self.assertEqual(events, [
+            ('start_map', None, []),
+            ('map_key', u'a', [u'a']),
+            ('start_array', None, [u'a']),
+            ('number', 1, [u'a', 0]),
+            ('start_map', None, [u'a', 1]),
+            ('map_key', u'b', [u'a', 1, u'b']),
+            ('boolean', True, [u'a', 1, u'b']),
+            ('end_map', None, [u'a', 1]),
+            ('end_array', None, [u'a']),
+            ('map_key', u'c', [u'c']),
+            ('null', None, [u'c']),
+            ('end_map', None, []),
+        ])
+
+
+class ReadsOnce(BytesIO):
+    """Fails if read again after `limit` bytes were read"""
+
+    def __init__(self, data, limit):
+        BytesIO.__init__(self, data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise AssertionError('Read past the end of the array')
+        return BytesIO.read(self, size)
+
+
+class IterItemsTestCase(TestCase):
+
+    def test_top_level_array(self):
+        items = iter_items(BytesIO('[1, [2], {"a": 3}]'))
+        self.assertEqual(list(items), [1, [2], {u'a': 3}])
+
+    def test_nested_array(self):
+        text = '{"map": {"rows": [[1, 2], [3, 4]], "tiles": [{"x": 1}]}}'
+        self.assertEqual(
+            list(iter_items(BytesIO(text), ('map', 'rows', 1))), [3, 4]
+        )
+        self.assertEqual(
+            list(iter_items(BytesIO(text), ('map', 'tiles'))), [{u'x': 1}]
+        )
+
+    def test_stops_after_array(self):
+        text = '{"tiles": [1, 2], "rest": "' + 'x' * 1000 + '"}'
+        stream = ReadsOnce(text, 20)
+        self.assertEqual(list(iter_items(stream, ('tiles',), chunk_size=4)),
+            [1, 2])
+
+    def test_missing_array(self):
+        items = iter_items(BytesIO('{"tiles": 1}'), ('tiles',))
+        self.assertRaises(JSONStreamError, list, items)
+
+    def test_schema(self):
+        text = '{"tiles": [{"x": 1}, {"x": 2}, {"x": "3"}, {"x": 4}]}'
+        items = iter_items(
+            BytesIO(text), ('tiles',), schema=Schema({u'x': AnyInteger})
+        )
+        self.assertEqual(next(items), {u'x': 1})
+        self.assertEqual(next(items), {u'x': 2})
+        try:
+            next(items)
+            self.fail('InvalidItemError should be raised')
+        except InvalidItemError as e:
+            error = e
+        self.assertEqual(error.path, u'.tiles[2]')
+        self.assertEqual(error.errors, [
+            u"$.tiles[2].x: expected AnyInteger, got u'3'"
+        ])
@@ -1,13 +1,19 @@
 import os
 import json
+import shutil
+import tempfile
+from io import BytesIO
 from StringIO import StringIO
 
 from unittest import TestCase
 
 from mock import Mock, MagicMock, call, patch
 
+from yape.fsm import FSMDefinition
+from yape.json_schema import Schema, AnyString
 from yape.manager import (GenericAssetManager, ImageManager, FontManager,
-    SpriteManager, JSONManager, Manager, JSONList)
+    SpriteManager, JSONManager, FSMManager, Manager, JSONDict, JSONList,
+    FrozenJSONDict, FrozenJSONList)
 
 
 class FakeRect(object):
@@ -223,6 +229,7 @@ class JSONManagerTestCase(TestCase):
         mock_open.return_value = StringIO(file_contents)
         json_data = self.manager.load(os.path.join('maps', 'map_1'))
         self.assertEqual(json_data, file_data)
+        self.assertTrue(isinstance(json_data, FrozenJSONDict))
 
     def test_json_with_list(self, mock_open):
         file_data = [
@@ -237,6 +244,167 @@ class JSONManagerTestCase(TestCase):
         mock_open.return_value = StringIO(file_contents)
         json_data = self.manager.load(os.path.join('maps', 'map_1'))
         self.assertEqual(json_data, file_data)
+        self.assertTrue(isinstance(json_data, FrozenJSONList))
+        self.assertTrue(isinstance(json_data[0], FrozenJSONDict))
+
+    def test_iter_items(self, mock_open):
+        file_contents = '{"tiles": [{"name": "grass"}, {"name": "rock"}]}'
+        mock_open.return_value = BytesIO(file_contents)
+        items = self.manager.iter_items(
+            os.path.join('maps', 'map_1'), ('tiles',)
+        )
+        self.assertEqual(list(items), [{'name': 'grass'}, {'name': 'rock'}])
+        expected_path = os.path.join(self.path, 'maps', 'map_1')
+        self.assertEqual(mock_open.call_args, call(expected_path, 'rb'))
+
+    def test_iter_items_no_file(self, mock_open):
+        mock_open.side_effect = IOError
+        items = self.manager.iter_items(os.path.join('maps', 'map_1'))
+        self.assertEqual(list(items), [])
+
+    def test_iter_items_invalid(self, mock_open):
+        file_contents = '[{"name": "grass"}, {"name": 1}, {"name": "rock"}]'
+        mock_open.return_value = BytesIO(file_contents)
+        items = self.manager.iter_items(
+            os.path.join('maps', 'map_1'), schema=Schema({u'name': AnyString})
+        )
+        self.assertEqual(list(items), [{'name': 'grass'}])
+
+
+class JSONManagerLoadManyTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manager = JSONManager(self.path)
+        self.files = {
+            'grass.json': {'name': 'grass'},
+            'rock.json': {'name': 'rock'},
+            'layers.json': [[1, 2], [3, 4]],
+            'bad_name.json': {'name': 1},
+        }
+        for filename, data in self.files.items():
+            with open(os.path.join(self.path, filename), 'w') as f:
+                json.dump(data, f)
+        with open(os.path.join(self.path, 'broken.json'), 'w') as f:
+            f.write('{"name": ')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_load_many(self):
+        filenames = sorted(self.files) + ['broken.json', 'missing.json']
+        for processes in (1, 2):
+            manager = JSONManager(self.path)
+            loaded = manager.load_many(filenames, processes=processes)
+            self.assertEqual(sorted(loaded), sorted(filenames))
+            for filename, data in self.files.items():
+                self.assertEqual(loaded[filename], data)
+                self.assertTrue(manager.get(filename) is loaded[filename])
+            self.assertTrue(isinstance(loaded['grass.json'], FrozenJSONDict))
+            self.assertTrue(isinstance(loaded['layers.json'], FrozenJSONList))
+            self.assertEqual(loaded['broken.json'], None)
+            self.assertEqual(loaded['missing.json'], None)
+
+    def test_load_many_schema(self):
+        schema = Schema({u'name': AnyString})
+        loaded = self.manager.load_many(
+            ['grass.json', 'rock.json', 'bad_name.json'], schema, processes=2
+        )
+        self.assertEqual(loaded['rock.json'], {'name': 'rock'})
+        self.assertEqual(loaded['bad_name.json'], None)
+
+    @patch('yape.manager.Pool')
+    def test_load_many_cached(self, mock_pool):
+        cached = self.manager.get('grass.json')
+        loaded = self.manager.load_many(['grass.json', 'rock.json'])
+        self.assertTrue(loaded['grass.json'] is cached)
+        self.assertEqual(loaded['rock.json'], {'name': 'rock'})
+        # A single file to load is loaded without a pool
+        self.assertFalse(mock_pool.called)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_load_many_cached_schema(self, mock_stdout):
+        self.manager.get('bad_name.json')
+        schema = Schema({u'name': AnyString})
+        loaded = self.manager.load_many(['bad_name.json'], schema)
+        self.assertTrue(loaded['bad_name.json'] is None)
+        self.assertTrue(mock_stdout.getvalue().startswith(
+            'Invalid data in file {0}'.format(
+                os.path.join(self.path, 'bad_name.json')
+            )
+        ))
+
+
+@patch('yape.manager.JSONManager.get')
+class FSMManagerTestCase(TestCase):
+
+    def setUp(self):
+        self.path = 'test_path'
+        self.manager = FSMManager(JSONManager(self.path))
+        self.data = JSONDict({
+            u'initial': u'idle',
+            u'transitions': [
+                {u'name': u'alert', u'source': u'idle', u'destination': u'chase'},
+                {u'name': u'calm', u'source': u'chase', u'destination': u'idle'},
+                {u'name': u'die', u'source': u'chase', u'destination': u'dead'},
+            ],
+            u'final': [u'dead'],
+        })
+
+    def test_load(self, mock_json_get):
+        mock_json_get.return_value = self.data
+        definition = self.manager.get('guard.json')
+        self.assertTrue(isinstance(definition, FSMDefinition))
+        self.assertEqual(mock_json_get.call_args, call('guard.json'))
+        guard = definition()
+        guard.alert()
+        self.assertTrue(guard.is_state(u'chase'))
+        # The compiled definition is cached
+        self.assertTrue(self.manager.get('guard.json') is definition)
+        self.assertEqual(mock_json_get.call_count, 1)
+
+    def test_load_missing(self, mock_json_get):
+        mock_json_get.return_value = None
+        self.assertEqual(self.manager.get('guard.json'), None)
+
+    def test_find_errors(self, mock_json_get):
+        self.assertEqual(self.manager.find_errors(self.data), [])
+        self.assertEqual(
+            self.manager.find_errors(JSONList([])),
+            ['A state machine must be a JSON object']
+        )
+        self.data[u'initial'] = 3
+        self.data[u'transitions'][1] = {u'name': u'calm'}
+        self.data[u'final'] = [None]
+        self.assertEqual(self.manager.find_errors(self.data), [
+            'initial must be a state name',
+            'transition 1 must have a name, source and destination',
+            'final must be a list of state names',
+        ])
+
+    def test_find_errors_transition_keys(self, mock_json_get):
+        self.data[u'transitions'][0] = {u'destination': u'chase'}
+        self.assertEqual(self.manager.find_errors(self.data), [
+            'transition 0 must have a name, source and destination',
+        ])
+        mock_json_get.return_value = self.data
+        self.assertEqual(self.manager.get('guard.json'), None)
+
+    def test_transition_extra_keys(self, mock_json_get):
+        self.data[u'transitions'][0][u'comment'] = u'Spotted the player'
+        self.assertEqual(self.manager.find_errors(self.data), [])
+        mock_json_get.return_value = self.data
+        self.assertTrue(
+            isinstance(self.manager.get('guard.json'), FSMDefinition)
+        )
+
+    def test_load_invalid_graph(self, mock_json_get):
+        del self.data[u'final']
+        self.data[u'transitions'].append(
+            {u'name': u'revive', u'source': u'ghost', u'destination': u'idle'}
+        )
+        mock_json_get.return_value = self.data
+        self.assertEqual(self.manager.get('guard.json'), None)
 
 
 class ManagerTestCase(TestCase):
@@ -261,6 +429,32 @@ class ManagerTestCase(TestCase):
         self.assertEqual(json_data, {})
         self.assertEqual(mock_json_get.call_args, call(os.path.join('map', 'map_1')))
 
+    @patch('yape.manager.JSONManager.load_many')
+    def test_load_json_many(self, mock_load_many):
+        path = os.path.join('map', 'map_1')
+        mock_load_many.return_value = {path: {}}
+        loaded = self.manager.load_json_many('map', ['map_1'])
+        self.assertEqual(loaded, {'map_1': {}})
+        self.assertEqual(mock_load_many.call_args, call([path], None, None))
+
+    @patch('yape.manager.JSONManager.iter_items')
+    def test_iter_json_items(self, mock_iter_items):
+        mock_iter_items.return_value = iter([])
+        self.manager.iter_json_items('map', 'map_1', ('tiles',))
+        self.assertEqual(
+            mock_iter_items.call_args,
+            call(os.path.join('map', 'map_1'), ('tiles',), None)
+        )
+
+    @patch('yape.manager.FSMManager.get')
+    def test_get_fsm(self, mock_fsm_get):
+        mock_fsm_get.return_value = ''
+        fsm_data = self.manager.get_fsm('fsm', 'guard.json')
+        self.assertEqual(fsm_data, '')
+        self.assertEqual(
+            mock_fsm_get.call_args, call(os.path.join('fsm', 'guard.json'))
+        )
+
     @patch('yape.manager.ImageManager.get')
     def test_get_image(self, mock_image_get):
         mock_image_get.return_value = ''
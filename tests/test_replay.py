@@ -0,0 +1,75 @@
+from StringIO import StringIO
+from unittest import TestCase
+
+import pygame
+from mock import Mock, MagicMock
+
+from yape.fsm import FSM
+from yape.dispatch import Dispatcher
+from yape.replay import EventRecorder, EventReplay, ReplayError
+
+
+class ReplayTestCase(TestCase):
+
+    def setUp(self):
+        self.frames = [
+            [
+                pygame.event.Event(pygame.KEYDOWN, key=97, mod=0, unicode=u'a'),
+                pygame.event.Event(pygame.MOUSEMOTION, pos=(3, 4), rel=(1, 1)),
+            ],
+            [],
+            [pygame.event.Event(pygame.QUIT)],
+        ]
+        self.event_queue = Mock(side_effect=self.frames)
+
+    def record(self):
+        stream = StringIO()
+        recorder = EventRecorder(self.event_queue, stream)
+        for frame in self.frames:
+            self.assertEqual(recorder(), frame)
+        self.assertEqual(recorder.frame_count, 3)
+        return StringIO(stream.getvalue())
+
+    def test_round_trip(self):
+        replay = EventReplay(self.record())
+        for frame in self.frames:
+            replayed = replay()
+            self.assertEqual(
+                [(e.type, e.dict) for e in replayed],
+                [(e.type, e.dict) for e in frame]
+            )
+        self.assertFalse(replay.finished)
+        self.assertEqual(replay(), [])
+        self.assertTrue(replay.finished)
+        self.assertEqual(replay(), [])
+        self.assertEqual(replay.frame_count, 3)
+
+    def test_unserializable_attributes_dropped(self):
+        event = MagicMock(type=1, dict={'key': 2, 'surface': object()})
+        stream = StringIO()
+        EventRecorder(Mock(return_value=[event]), stream)()
+        replayed = EventReplay(StringIO(stream.getvalue()))()
+        self.assertEqual(replayed[0].dict, {'key': 2})
+
+    def test_bad_header(self):
+        self.assertRaises(ReplayError, EventReplay, StringIO('not a log'))
+
+    def test_truncated_log(self):
+        data = self.record().getvalue()
+        replay = EventReplay(StringIO(data[:-3]))
+        replay()
+        replay()
+        self.assertRaises(ReplayError, replay)
+
+    def test_dispatcher_replay(self):
+        transitions = [
+            {'name': 'start', 'source': 'menu', 'destination': 'main'},
+        ]
+        mock_game_data = MagicMock(state=FSM('main', transitions))
+        listener = Mock()
+        dispatcher = Dispatcher(EventReplay(self.record()))
+        dispatcher.register('main', listener, pygame.QUIT)
+        for _ in range(len(self.frames)):
+            dispatcher.handle_events(mock_game_data)
+        self.assertEqual(listener.call_count, 1)
+        self.assertEqual(listener.call_args[0][0].type, pygame.QUIT)
@@ -0,0 +1,90 @@
+import copy
+import pickle
+import weakref
+
+from unittest import TestCase
+
+from yape.json_schema import Schema, AnyInteger
+from yape.types import (
+    JSONDict, JSONList, FrozenJSONDict, FrozenJSONList, freeze,
+)
+
+
+class FrozenJSONTestCase(TestCase):
+
+    def setUp(self):
+        self.data = freeze({
+            'name': 'level',
+            'layers': [{'data': [1, 2]}],
+        })
+
+    def test_freeze_nested(self):
+        self.assertTrue(isinstance(self.data, FrozenJSONDict))
+        self.assertTrue(isinstance(self.data['layers'], FrozenJSONList))
+        self.assertTrue(isinstance(self.data['layers'][0], FrozenJSONDict))
+        self.assertTrue(
+            isinstance(self.data['layers'][0]['data'], FrozenJSONList)
+        )
+        self.assertTrue(freeze(self.data) is self.data)
+        self.assertEqual(freeze('text'), 'text')
+        self.assertEqual(
+            self.data, {'name': 'level', 'layers': [{'data': [1, 2]}]}
+        )
+
+    def test_freeze_mixed(self):
+        data = FrozenJSONDict([
+            ('stats', JSONDict({'hp': 1})), ('tags', ['a', [1.5, None]]),
+        ])
+        self.assertTrue(type(data['stats']) is FrozenJSONDict)
+        self.assertTrue(type(data['tags']) is FrozenJSONList)
+        self.assertTrue(type(data['tags'][1]) is FrozenJSONList)
+        self.assertEqual(data, {'stats': {'hp': 1}, 'tags': ['a', [1.5, None]]})
+
+    def test_read_only(self):
+        layers = self.data['layers']
+        changes = [
+            lambda: self.data.__setitem__('name', 'other'),
+            lambda: self.data.__delitem__('name'),
+            lambda: self.data.update(name='other'),
+            lambda: self.data.setdefault('size', 1),
+            lambda: self.data.pop('name'),
+            self.data.popitem, self.data.clear,
+            lambda: layers.append(1),
+            lambda: layers.extend([1]),
+            lambda: layers.insert(0, 1),
+            lambda: layers.__setitem__(0, 1),
+            lambda: layers.__setslice__(0, 1, [1]),
+            lambda: layers.__iadd__([1]),
+            layers.pop, layers.reverse, layers.sort,
+        ]
+        for change in changes:
+            self.assertRaises(TypeError, change)
+        self.assertEqual(
+            self.data, {'name': 'level', 'layers': [{'data': [1, 2]}]}
+        )
+
+    def test_thaw(self):
+        changed = self.data.thaw()
+        self.assertTrue(type(changed) is JSONDict)
+        changed['name'] = 'other'
+        layers = changed['layers'] = self.data['layers'].thaw()
+        self.assertTrue(type(layers) is JSONList)
+        layers.append({})
+        self.assertTrue(layers[0] is self.data['layers'][0])
+        self.assertEqual(self.data['name'], 'level')
+        self.assertEqual(len(self.data['layers']), 1)
+
+    def test_copies_share(self):
+        self.assertTrue(copy.copy(self.data) is self.data)
+        self.assertTrue(copy.deepcopy(self.data) is self.data)
+        unpickled = pickle.loads(pickle.dumps(self.data))
+        self.assertEqual(unpickled, self.data)
+        self.assertTrue(isinstance(unpickled['layers'], FrozenJSONList))
+
+    def test_weak_references(self):
+        self.assertTrue(weakref.ref(self.data)() is self.data)
+
+    def test_schema(self):
+        schema = Schema({u'layers': [{u'data': [AnyInteger]}]})
+        self.assertTrue(schema.is_valid(self.data))
+        self.assertEqual(schema.find_errors(self.data), [])
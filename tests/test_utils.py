@@ -1,7 +1,7 @@
 from unittest import TestCase
 
 from yape.utils import (is_non_string_iterable, validate_data_against_schema,
-    word_wrap)
+    word_wrap, compile_schema, CompiledSchema)
 
 
 class IsNonStringIterable(TestCase):
@@ -17,6 +17,57 @@ class IsNonStringIterable(TestCase):
         )))
 
 
+SCHEMAS = [
+    'name',
+    ['a', 'b'],
+    {'name': 'crate'},
+    {'name': 'crate', 'tags': ['solid', 'heavy']},
+    {'layers': [{'data': 1}]},
+    [['x']],
+    [],
+    {},
+]
+
+DATA = [
+    'name', 'crate', 'a b', ['a', 'b'], ['a'], [['a', 'b'], ['ab']],
+    {'name': 'crate'}, {'name': 'wooden crate', 'tags': ['solid heavy']},
+    {'name': 'crate', 'tags': [['solid', 'heavy']]},
+    {'layers': [{'data': [1, 2]}, {'data': [2]}]}, {'layers': []}, {'x': 1},
+    [], {}, ('x', ['x']), set(['x']),
+]
+
+
+def outcome(schema, data):
+    """Validates with `schema`, returning the type of any exception raised"""
+    try:
+        return schema(data)
+    except Exception as e:
+        return type(e)
+
+
+class CompileSchemaTestCase(TestCase):
+
+    def test_same_results(self):
+        for schema in SCHEMAS:
+            compiled = compile_schema(schema)
+            self.assertTrue(isinstance(compiled, CompiledSchema))
+            for data in DATA:
+                expected = outcome(
+                    lambda data: validate_data_against_schema(data, schema),
+                    data
+                )
+                self.assertEqual(outcome(compiled, data), expected,
+                    (schema, data))
+                self.assertEqual(outcome(compiled.validate, data), expected)
+
+    def test_validate_many(self):
+        compiled = compile_schema({'name': 'crate'})
+        self.assertEqual(
+            compiled.validate_many([{'name': 'crate'}, {'name': 'door'}, {}]),
+            [True, False, False]
+        )
+
+
 class WordWrapTestCase(TestCase):
 
     def test_hyphenate_multiple_words(self):
@@ -0,0 +1,124 @@
+from yape.fsm import FSM, state_path
+
+# numpy is optional, and only needed for BatchFSM
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class BatchFSM(object):
+    """
+    A state machine for a whole population of entities that share the same
+    transitions. Takes the name of the initial state, a list of transitions
+    in the same format FSM uses, and the number of entities.
+
+    States are stored as one small integer per entity in the `states` array
+    and each transition is a lookup table from source state to destination
+    state, so a transition is applied to every selected entity in a single
+    vectorized step:
+
+        crowd = BatchFSM('idle', transitions, 5000)
+        moved = crowd.apply('alert', mask=crowd.is_state('patrol'))
+        for index in numpy.flatnonzero(moved):
+            on_alert(entities[index])
+
+    Callbacks are not supported, since the point is to not make a Python call
+    per entity. Use the boolean array returned by `apply` to run them for just
+    the entities that transitioned.
+    """
+
+    def __init__(self, initial, transitions, size):
+        if numpy is None:
+            raise ImportError('BatchFSM requires numpy')
+        # Validate the transitions and index them exactly as FSM does
+        prototype = FSM(initial, transitions)
+        self.state_names = sorted(prototype.possible_states)
+        self.state_ids = dict(
+            (state, state_id) for state_id, state in enumerate(self.state_names)
+        )
+        self.dtype = numpy.min_scalar_type(-len(self.state_names))
+        # Maps each transition name to an array where each state id holds its
+        # destination state id, or -1 if the transition isn't possible from
+        # that state. Substates take the transitions of their parent states
+        self.tables = {}
+        for name, destinations in prototype._destinations.items():
+            table = numpy.empty(len(self.state_names), dtype=self.dtype)
+            table.fill(-1)
+            for state, state_id in self.state_ids.items():
+                for source in state_path(state):
+                    if source in destinations:
+                        table[state_id] = self.state_ids[destinations[source]]
+                        break
+            self.tables[name] = table
+        self.states = numpy.empty(size, dtype=self.dtype)
+        self.states.fill(self.state_ids[initial])
+
+    def __len__(self):
+        return len(self.states)
+
+    def _as_mask(self, mask):
+        """Given a boolean mask or an array of indices, return a boolean mask"""
+        mask = numpy.asarray(mask)
+        if mask.dtype == numpy.bool_:
+            return mask
+        if mask.size == 0:
+            # An empty list of indices is an array of floats otherwise
+            mask = mask.astype(numpy.intp)
+        bool_mask = numpy.zeros(len(self.states), dtype=numpy.bool_)
+        bool_mask[mask] = True
+        return bool_mask
+
+    def _table(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            err_msg = u'{0} is not a transition name'
+            raise FSM.IllegalTransitionException(err_msg.format(name))
+
+    def apply(self, name, mask=None):
+        """
+        Applies the transition `name` to each entity selected by `mask` (a
+        boolean array or an array of indices, or every entity if not given)
+        that is in a source state of the transition. Entities that can not
+        make the transition are left as they are. Returns a boolean array that
+        is True for each entity that transitioned.
+        """
+        destinations = self._table(name)[self.states]
+        moved = destinations >= 0
+        if mask is not None:
+            moved &= self._as_mask(mask)
+        self.states[moved] = destinations[moved]
+        return moved
+
+    def can(self, name):
+        """
+        Returns a boolean array that is True for each entity that can make the
+        transition `name` from its current state
+        """
+        return self._table(name)[self.states] >= 0
+
+    def is_state(self, state):
+        """
+        Returns a boolean array that is True for each entity in the `state`
+        """
+        return self.states == self.state_ids[state]
+
+    def set_state(self, state, mask=None):
+        """
+        Moves each entity selected by `mask` (or every entity) to the `state`,
+        without regard to the transitions
+        """
+        if mask is None:
+            self.states.fill(self.state_ids[state])
+        else:
+            self.states[self._as_mask(mask)] = self.state_ids[state]
+
+    def state_of(self, index):
+        """Returns the name of the state of the entity at `index`"""
+        return self.state_names[self.states[index]]
+
+    def counts(self):
+        """Returns a dictionary of each state to the number of its entities"""
+        counts = numpy.bincount(self.states, minlength=len(self.state_names))
+        return dict(zip(self.state_names, counts.tolist()))
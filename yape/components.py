@@ -1,3 +1,256 @@
+import hashlib
+import json
+import weakref
+from collections import deque
+
+from yape.types import (
+    JSONDict, JSONList, FrozenJSONDict, FrozenJSONList,
+)
+from yape.entity_store import ColumnField
+
+
+# Marks a LazyAssetField that has no class level default
+NO_DEFAULT = object()
+
+
+# The types of containers and values that ValidationCache remembers data of
+# by content. Schemas tell every one of these apart, and so does the JSON
+# encoding used as the key, unlike tuples and lists, or str and unicode
+_json_map_types = (dict, JSONDict, FrozenJSONDict)
+_json_sequence_types = (list, JSONList, FrozenJSONList)
+_json_value_types = (unicode, int, float, bool, type(None))
+
+
+def _is_plain_json(data):
+    """
+    Returns True if `data` holds nothing but JSON containers and values of
+    the exact types json.loads produces, with string keys
+    """
+    typ = type(data)
+    if typ in _json_map_types:
+        for key, value in data.iteritems():
+            if type(key) not in (unicode, str) or not _is_plain_json(value):
+                return False
+        return True
+    elif typ in _json_sequence_types:
+        for value in data:
+            if not _is_plain_json(value):
+                return False
+        return True
+    return typ in _json_value_types
+
+
+class ComponentSpec(object):
+    """
+    What BaseComponent needs to know about a component class: the names of
+    its 'clean_' validators paired with the fields they validate, and the
+    asset fields declared by its *_fields attributes, as (field type, manager
+    method, field names) tuples.
+    """
+
+    def __init__(self, cls):
+        self.generation = ComponentType.generation
+        self.validators = tuple(
+            (attr, attr[attr.find('_') + 1:])
+            for attr in dir(cls)
+            if attr.startswith('clean_')
+        )
+        self.asset_fields = tuple(
+            (field_type, manager_method, getattr(cls, field_type))
+            for field_type, manager_method in cls.field_method_mapping
+            if getattr(cls, field_type, None)
+        )
+        # With lazy_asset_fields, each asset field that the class doesn't
+        # otherwise define, or defines as None, is resolved by a
+        # LazyAssetField on first access
+        lazy_fields = set()
+        if getattr(cls, 'lazy_asset_fields', False):
+            for field_type, manager_method, names in self.asset_fields:
+                for name in names:
+                    default = getattr(cls, name, NO_DEFAULT)
+                    if default is None or default is NO_DEFAULT:
+                        type.__setattr__(
+                            cls, name, LazyAssetField(name, default)
+                        )
+                    if isinstance(getattr(cls, name), LazyAssetField):
+                        lazy_fields.add(name)
+        self.lazy_fields = frozenset(lazy_fields)
+
+
+class LazyAssetField(object):
+    """
+    A non-data descriptor that stands in for an asset field of a component
+    with `lazy_asset_fields`. The field's arguments are kept aside when the
+    component is loaded, and the asset is only requested from the manager the
+    first time the field is accessed. The result is then stored on the
+    instance, where it hides the descriptor from then on. Without arguments
+    to resolve, the field is the `default` that the class defined before the
+    descriptor replaced it.
+    """
+
+    def __init__(self, name, default=NO_DEFAULT):
+        self.name = name
+        self.default = default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            field_type, manager_method, asset_args = instance._lazy_assets.pop(
+                self.name
+            )
+        except KeyError:
+            if self.default is NO_DEFAULT:
+                raise AttributeError(self.name)
+            return self.default
+        asset = instance._resolve_asset_field(
+            field_type, manager_method, self.name, asset_args
+        )
+        instance.__dict__[self.name] = asset
+        return asset
+
+
+class ValidationCache(object):
+    """
+    Remembers the schema errors found in validated data, so that data that
+    many components are built from, such as enemy templates, is only checked
+    against each schema once. Frozen JSON assets from the manager
+    (FrozenJSONDict and FrozenJSONList) can't change, so they are remembered
+    by identity, and forgotten when the asset is freed, as when it's
+    reloaded. Other data is validated every time, unless `hash_content` is
+    True, in which case data that holds only plain JSON types is remembered
+    by a hash of its content. Hashing costs more than validating most data,
+    so only turn it on for large data that is validated repeatedly. Holds
+    the errors for up to `size` pairs of schema and data, forgetting the
+    oldest first.
+    """
+
+    def __init__(self, size=1024, hash_content=False):
+        self.size = size
+        self.hash_content = hash_content
+        # Maps (schema, data key) to a tuple of error messages
+        self._errors = {}
+        # The keys of self._errors, oldest first, possibly with some that
+        # were forgotten since
+        self._order = deque()
+        # Maps the ids of remembered JSON assets to a weak reference to the
+        # asset, and the schemas it has been checked against
+        self._refs = {}
+
+    def __len__(self):
+        return len(self._errors)
+
+    def clear(self):
+        self._errors.clear()
+        self._order.clear()
+        self._refs.clear()
+
+    def _content_key(self, data):
+        """Returns the hash of `data`, or None if it can't be remembered"""
+        if not _is_plain_json(data):
+            return None
+        try:
+            content = json.dumps(data, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha1(content).digest()
+
+    def _remember_ref(self, data, schema):
+        data_id = id(data)
+        if data_id not in self._refs:
+            ref = weakref.ref(
+                data, lambda ref, data_id=data_id: self._forget(data_id)
+            )
+            self._refs[data_id] = (ref, [])
+        self._refs[data_id][1].append(schema)
+
+    def _forget(self, data_id):
+        ref, schemas = self._refs.pop(data_id, (None, ()))
+        for schema in schemas:
+            self._errors.pop((schema, data_id), None)
+
+    def _evict(self, key):
+        if self._errors.pop(key, None) is None:
+            return
+        schema, data_key = key
+        if data_key in self._refs:
+            schemas = self._refs[data_key][1]
+            schemas.remove(schema)
+            if not schemas:
+                del self._refs[data_key]
+
+    def find_errors(self, schema, data):
+        """
+        Returns `schema.find_errors(data)`, only calling it if the errors for
+        the schema and data aren't remembered already
+        """
+        is_asset = isinstance(data, (FrozenJSONDict, FrozenJSONList))
+        if is_asset:
+            data_key = id(data)
+        elif self.hash_content:
+            data_key = self._content_key(data)
+        else:
+            return schema.find_errors(data)
+        if data_key is None:
+            return schema.find_errors(data)
+        key = (schema, data_key)
+        try:
+            return list(self._errors[key])
+        except KeyError:
+            pass
+        errors = schema.find_errors(data)
+        self._errors[key] = tuple(errors)
+        self._order.append(key)
+        if is_asset:
+            self._remember_ref(data, schema)
+        while len(self._errors) > self.size:
+            self._evict(self._order.popleft())
+        # Drop the keys of forgotten assets once they pile up
+        if len(self._order) > 2 * self.size:
+            self._order = deque(key for key in self._order
+                                if key in self._errors)
+        return errors
+
+
+class ComponentType(type):
+    """
+    Metaclass of the components, which introspects each component class once
+    rather than each of its instances. The resulting ComponentSpec is cached
+    on the class until an attribute of any component class is changed, since
+    that could change what a class or its subclasses declare. The fields named
+    in `column_fields` are given their ColumnField when the class is created.
+    """
+
+    # Incremented whenever an attribute of a component class changes
+    generation = 0
+
+    def __init__(cls, name, bases, attrs):
+        super(ComponentType, cls).__init__(name, bases, attrs)
+        for field in getattr(cls, 'column_fields', ()):
+            default = getattr(cls, field, NO_DEFAULT)
+            if isinstance(default, ColumnField):
+                continue
+            elif default is NO_DEFAULT:
+                column_field = ColumnField(field)
+            else:
+                column_field = ColumnField(field, default)
+            type.__setattr__(cls, field, column_field)
+
+    def __setattr__(cls, name, value):
+        type.__setattr__(cls, name, value)
+        ComponentType.generation += 1
+
+    def __delattr__(cls, name):
+        type.__delattr__(cls, name)
+        ComponentType.generation += 1
+
+    def get_spec(cls):
+        """Returns the ComponentSpec of the class, creating it if needed"""
+        spec = cls.__dict__.get('_spec')
+        if spec is None or spec.generation != ComponentType.generation:
+            spec = ComponentSpec(cls)
+            type.__setattr__(cls, '_spec', spec)
+        return spec
 
 
 class BaseComponent(object):
@@ -6,6 +259,8 @@ class BaseComponent(object):
     LoadableComponent classes.
     """
 
+    __metaclass__ = ComponentType
+
     field_method_mapping = [
         ('image_fields', 'get_image'),
         ('sprite_fields', 'get_sprite'),
@@ -13,20 +268,45 @@ class BaseComponent(object):
         ('json_fields', 'get_json'),
     ]
 
+    # If True, assets are loaded when their field is first accessed rather
+    # than when the component is loaded
+    lazy_asset_fields = False
+
+    # The numeric fields that can be kept in an EntityStore
+    column_fields = ()
+
+    # Remembers the results of checking data against the schema. Set to None
+    # to check the data every time
+    validation_cache = ValidationCache()
+
+    # The assets dictionary shared by the components Component.load_many is
+    # creating, if any
+    _batch_assets = None
+
     def __init__(self, manager, *args):
         self.manager = manager
-        # Determine what methods to call when validating individual fields
-        self.field_validators = [
-            getattr(self, attr)
-            for attr in dir(self)
-            if attr.startswith('clean_')
-        ]
         self.errors = []
+        # Maps the names of lazy asset fields that have not been accessed yet
+        # to their field type, manager method and asset arguments
+        self._lazy_assets = {}
 
-    def load(self, data):
+    @property
+    def field_validators(self):
+        """The methods to call when validating individual fields"""
+        validators = type(self).get_spec().validators
+        return [getattr(self, attr) for attr, field in validators]
+
+    def load(self, data, assets=None):
+        """
+        Validates and processes `data`. See process_auto_fields for the
+        optional `assets` dictionary, which defaults to the one shared by the
+        batch of components being created, during Component.load_many.
+        """
+        if assets is None:
+            assets = self._batch_assets
         if self.is_valid(data):
             self.process_data(data)
-            self.process_auto_fields()
+            self.process_auto_fields(assets)
             if hasattr(self, 'post_process'):
                 self.post_process()
         else:
@@ -41,36 +321,64 @@ class BaseComponent(object):
             for key, value in data.items():
                 setattr(self, key, value)
 
-    def process_auto_fields(self):
+    def process_auto_fields(self, assets=None):
         """
         Replaces image, font, sound, and json fields with references to those
         objects, using the component's manager. Uses the component's *_fields
         methods to determine what fields should be associated with a given type
         of asset (such as image, or font).
+
+        If the component has `lazy_asset_fields`, the fields are left to be
+        resolved when they are first accessed instead.
+
+        `assets` is an optional dictionary of the assets already loaded, keyed
+        by manager method and arguments, which is shared by components that
+        are loaded together so each asset is only requested once.
         """
-        for field_type, manager_method in self.field_method_mapping:
-            asset_field_names = getattr(self, field_type, [])
+        spec = type(self).get_spec()
+        instance_dict = self.__dict__
+        for field_type, manager_method, asset_field_names in spec.asset_fields:
             for asset_field_name in asset_field_names:
+                if (asset_field_name in spec.lazy_fields and
+                        instance_dict.get(asset_field_name) is not None):
+                    # Removing the attribute exposes the LazyAssetField
+                    self._lazy_assets[asset_field_name] = (
+                        field_type, manager_method,
+                        instance_dict.pop(asset_field_name)
+                    )
+                    continue
                 asset_args = getattr(self, asset_field_name, None)
                 if asset_args is not None:
-                    # If the field is a dictionary, load assets for its values and
-                    # assign them to the keys of the dictionary
-                    if isinstance(asset_args, dict):
-                        for key, value in asset_args.items():
-                            asset_ref = self._get_asset_ref(
-                                field_type, manager_method, asset_field_name, value
-                            )
-                            asset_args[key] = asset_ref
-                    else:
-                        asset_ref = self._get_asset_ref(
-                            field_type, manager_method, asset_field_name, asset_args
-                        )
-                        setattr(self, asset_field_name, asset_ref)
+                    setattr(self, asset_field_name, self._resolve_asset_field(
+                        field_type, manager_method, asset_field_name,
+                        asset_args, assets
+                    ))
 
-    def _get_asset_ref(self, field_type, manager_method, asset_field_name, asset_args):
+    def _resolve_asset_field(self, field_type, manager_method,
+            asset_field_name, asset_args, assets=None):
+        """
+        Returns the asset(s) for the arguments `asset_args` of an asset field
+        """
+        # If the field is a dictionary, load assets for its values and
+        # return a new dictionary of them, since the field's dictionary may
+        # be shared, frozen JSON data
+        if isinstance(asset_args, dict):
+            return dict(
+                (key, self._get_asset_ref(
+                    field_type, manager_method, asset_field_name, value, assets
+                ))
+                for key, value in asset_args.items()
+            )
+        return self._get_asset_ref(
+            field_type, manager_method, asset_field_name, asset_args, assets
+        )
+
+    def _get_asset_ref(self, field_type, manager_method, asset_field_name,
+            asset_args, assets=None):
         """
         Uses manager methods to load assets on behalf of a field in a *_fields
-        declaration.
+        declaration. If an `assets` dictionary is given, assets are looked up
+        in it first and added to it once loaded.
         """
         # image field values are filenames only, while other asset
         # arguments are iterable. Wrap filename inside a list so it
@@ -83,6 +391,16 @@ class BaseComponent(object):
             width, height = self.sprite_fields[asset_field_name]
             asset_args = list(asset_args)
             asset_args.extend([width, height])
+        asset_key = None
+        if assets is not None:
+            try:
+                asset_key = (manager_method, tuple(asset_args))
+                return assets[asset_key]
+            except KeyError:
+                pass
+            except TypeError:
+                # Arguments that can't be hashed are never shared
+                asset_key = None
         # Determine what method to call on the manager for the
         # current field type
         load_func = getattr(self.manager, manager_method)
@@ -92,6 +410,8 @@ class BaseComponent(object):
             print err_msg.format(
                 asset_args, asset_field_name, self.__class__.__name__
             )
+        if asset_key is not None:
+            assets[asset_key] = asset
         return asset
 
     def is_valid(self, raw_data):
@@ -109,15 +429,16 @@ class BaseComponent(object):
         # Check the data against the component's schema
         schema = getattr(self, 'schema', None)
         if schema:
-            errors = schema.find_errors(raw_data)
+            if self.validation_cache is not None:
+                errors = self.validation_cache.find_errors(schema, raw_data)
+            else:
+                errors = schema.find_errors(raw_data)
             if errors:
                 self.errors = errors
                 return False
         # Check each field of the data against its respective clean method
-        for validator in self.field_validators:
-            validator_name = validator.__name__
-            field = validator_name[validator_name.find('_') + 1:]
-            if not validator(raw_data.get(field, {})):
+        for attr, field in type(self).get_spec().validators:
+            if not getattr(self, attr)(raw_data.get(field, {})):
                 if not self.errors:
                     self.errors.append('{0} was not valid'.format(field))
                 return False
@@ -141,6 +462,27 @@ class Component(BaseComponent):
         if data is not None:
             self.load(data)
 
+    @classmethod
+    def load_many(cls, manager, data_list):
+        """
+        Returns a list with a component for each dictionary in `data_list`,
+        created with `cls(manager, data)`. The asset fields of the whole batch
+        are resolved together through an assets dictionary that `load` reads
+        from the class while the batch is created, so each distinct asset is
+        only requested from the manager once, however many components use it.
+        """
+        # Set through type, since the batch assets don't change what the class
+        # declares and so shouldn't invalidate the cached ComponentSpecs
+        previous = cls.__dict__.get('_batch_assets')
+        type.__setattr__(cls, '_batch_assets', {})
+        try:
+            return [cls(manager, data) for data in data_list]
+        finally:
+            if previous is None:
+                type.__delattr__(cls, '_batch_assets')
+            else:
+                type.__setattr__(cls, '_batch_assets', previous)
+
 
 class LoadableComponent(BaseComponent):
     """
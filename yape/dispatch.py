@@ -1,17 +1,202 @@
+import weakref
 from collections import defaultdict
+from timeit import default_timer
 
 import pygame
 
+from yape.fsm import state_path
+
+
+# Used in place of a missing listener set so lookups don't grow the registry
+NO_LISTENERS = frozenset()
+
+
+class WeakListener(object):
+    """
+    Stands in for a bound method listener without keeping the instance the
+    method is bound to alive. Compares and hashes equal to the bound method it
+    was created from, so it can be looked up and removed using that method.
+    Once the instance is garbage collected, `on_dead` is called with the
+    WeakListener so it can be removed from the registry.
+    """
+
+    __slots__ = ('func', 'key', 'owner_ref', '_hash')
+
+    def __init__(self, method, key, on_dead):
+        self.func = method.__func__
+        self.key = key
+        # Raises TypeError for methods of unhashable instances
+        self._hash = hash(method)
+        # Raises TypeError for instances that can't be weakly referenced
+        self.owner_ref = weakref.ref(method.__self__, lambda ref: on_dead(self))
+
+    @property
+    def owner(self):
+        return self.owner_ref()
+
+    @property
+    def __name__(self):
+        return self.func.__name__
+
+    def __call__(self, *args, **kwargs):
+        owner = self.owner_ref()
+        if owner is not None:
+            return self.func(owner, *args, **kwargs)
+
+    def _matches(self, owner, func):
+        return func is self.func and owner is not None \
+            and owner is self.owner_ref()
+
+    def __eq__(self, other):
+        if isinstance(other, WeakListener):
+            return other is self or self._matches(other.owner, other.func)
+        return self._matches(
+            getattr(other, '__self__', None), getattr(other, '__func__', None)
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return u'<WeakListener {0} of {1!r}>'.format(
+            self.func.__name__, self.owner
+        )
+
+
+class ListenerStats(object):
+    """
+    Timing statistics of one listener for one state and event type pairing.
+    Times are in seconds.
+    """
+
+    __slots__ = (
+        'listener', 'state', 'event_type', 'calls', 'total_time', 'max_time'
+    )
+
+    def __init__(self, listener, state, event_type):
+        self.listener = listener
+        self.state = state
+        self.event_type = event_type
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def __repr__(self):
+        return u'{0} ({1}, {2}): {3} calls, {4:.6f}s total, {5:.6f}s max'.format(
+            getattr(self.listener, '__name__', self.listener), self.state,
+            self.event_type, self.calls, self.total_time, self.max_time
+        )
+
+
+class DispatchProfiler(object):
+    """
+    Collects per-listener timings on behalf of a Dispatcher with profiling
+    enabled. If a `frame_budget` (in seconds) is given, listeners whose
+    combined time within one call to `handle_events` exceeds it are flagged.
+    """
+
+    def __init__(self, frame_budget=None, timer=default_timer):
+        self.frame_budget = frame_budget
+        self.timer = timer
+        self.reset()
+
+    def reset(self):
+        # Maps a (listener, state, event_type) triple to its ListenerStats
+        self.stats = {}
+        # Maps each listener to its time spent in the current frame
+        self.frame_times = defaultdict(float)
+        # Maps each listener to the number of frames it exceeded the budget
+        self.frames_over_budget = defaultdict(int)
+
+    def record(self, listener, state, event_type, elapsed):
+        key = (listener, state, event_type)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = ListenerStats(listener, state, event_type)
+        stats.calls += 1
+        stats.total_time += elapsed
+        if elapsed > stats.max_time:
+            stats.max_time = elapsed
+        self.frame_times[listener] += elapsed
+
+    def end_frame(self):
+        """Flags listeners that exceeded the frame budget this frame"""
+        if self.frame_budget is not None:
+            for listener, elapsed in self.frame_times.items():
+                if elapsed > self.frame_budget:
+                    self.frames_over_budget[listener] += 1
+        self.frame_times.clear()
+
+    def report(self):
+        """
+        Returns the collected ListenerStats, sorted from the most to the least
+        total time spent
+        """
+        return sorted(
+            self.stats.values(), key=lambda stats: stats.total_time,
+            reverse=True
+        )
+
+    def over_budget(self):
+        """
+        Returns a list of (listener, frame count) pairs for listeners that
+        exceeded the frame budget, sorted from the most to the least frames
+        """
+        return sorted(
+            self.frames_over_budget.items(), key=lambda item: item[1],
+            reverse=True
+        )
+
 
 class Dispatcher(object):
     """
     An event dispatcher that registers event listeners and dispatchs events to
     them based on the current game state using a provided event queue.
+
+    If an `event_filter` is provided, it is called with the event types that
+    have listeners in the current state (or None if a listener takes every
+    event type) whenever that set changes, so the event source can drop events
+    no listener would receive. See `set_pygame_event_filter`.
+
+    If an `input_state` (see yape.input_state.InputState) is provided, it is
+    updated with each frame's events before they are dispatched, and the event
+    types it needs are never filtered out.
+
+    Listeners registered for a state are also called in each of its substates
+    (see FSM), so a listener for 'game' receives events while the game is in
+    'game.dialogue'. The listeners of each state and event type pairing are
+    resolved along the state's path once and cached until the registry
+    changes.
+
+    Listeners that are bound methods are held weakly, so registering a method
+    of a screen or entity does not keep it alive. Such listeners are removed
+    from the registry once their instance is garbage collected.
     """
 
-    def __init__(self, event_queue):
+    def __init__(self, event_queue, event_filter=None, input_state=None):
         self.event_queue = event_queue
+        self.event_filter = event_filter
         self.listeners = defaultdict(set)
+        # Caches the listeners to call for each state and event type pairing
+        self._resolved = {}
+        self.profiler = None
+        # The state the event filter was last applied for, and whether the
+        # listener registry or input state changed since then
+        self._filtered_state = None
+        self._filter_stale = True
+        self._input_state = input_state
+
+    @property
+    def input_state(self):
+        return self._input_state
+
+    @input_state.setter
+    def input_state(self, input_state):
+        self._input_state = input_state
+        self._filter_stale = True
 
     def register(self, state, listener, event_type=None):
         """
@@ -21,7 +206,76 @@ class Dispatcher(object):
         the listener is called whenever the game is in the given state,
         regardless of the event.
         """
-        self.listeners[(state, event_type)].add(listener)
+        key = (state, event_type)
+        self.listeners[key].add(self._make_listener(listener, key))
+        self._registry_changed()
+
+    def _registry_changed(self):
+        self._resolved.clear()
+        self._filter_stale = True
+
+    def _make_listener(self, listener, key):
+        """
+        Returns a WeakListener for bound methods, or the listener itself for
+        any other callable or if the method's instance can't be weakly held.
+        """
+        owner = getattr(listener, '__self__', None)
+        func = getattr(listener, '__func__', None)
+        if owner is None or func is None:
+            return listener
+        try:
+            return WeakListener(listener, key, self._remove_dead_listener)
+        except TypeError:
+            return listener
+
+    def _remove_dead_listener(self, listener):
+        """Removes a WeakListener whose instance was garbage collected"""
+        listeners = self.listeners.get(listener.key)
+        if listeners is not None:
+            listeners.discard(listener)
+            if not listeners:
+                del self.listeners[listener.key]
+        self._registry_changed()
+
+    def unregister(self, state, listener, event_type=None):
+        """
+        Removes a `listener` registered for the given `state` and
+        `event_type`. Returns True if the listener was registered.
+        """
+        key = (state, event_type)
+        listeners = self.listeners.get(key)
+        if not listeners or listener not in listeners:
+            return False
+        listeners.discard(listener)
+        if not listeners:
+            del self.listeners[key]
+        self._registry_changed()
+        return True
+
+    def unregister_owner(self, owner):
+        """
+        Removes every listener that is a method bound to `owner`, for all
+        states and event types. Returns the number of listeners removed.
+        """
+        removed = 0
+        for key, listeners in list(self.listeners.items()):
+            owned = [
+                listener for listener in listeners
+                if getattr(listener, 'owner', None) is owner
+                or getattr(listener, '__self__', None) is owner
+            ]
+            if owned:
+                listeners.difference_update(owned)
+                removed += len(owned)
+                if not listeners:
+                    del self.listeners[key]
+        if removed:
+            self._registry_changed()
+        return removed
+
+    def registry_size(self):
+        """Returns the number of registered listeners across all states"""
+        return sum(len(listeners) for listeners in self.listeners.values())
 
     def register_listener(self, states, event_type=None):
         """
@@ -39,6 +293,26 @@ class Dispatcher(object):
             return f
         return decorator
 
+    def resolve_listeners(self, state, event_type):
+        """
+        Returns the listeners to call for an event of `event_type` in the given
+        `state`: those registered for the event type or for no event type, in
+        the state or any of its parent states.
+        """
+        key = (state, event_type)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = set()
+            for path_state in state_path(state):
+                resolved.update(
+                    self.listeners.get((path_state, event_type), NO_LISTENERS)
+                )
+                resolved.update(
+                    self.listeners.get((path_state, None), NO_LISTENERS)
+                )
+            resolved = self._resolved[key] = frozenset(resolved)
+        return resolved
+
     def dispatch(self, event, game_data, *args, **kwargs):
         """
         Given a pygame event, the `game_data`, and any args/kwargs,
@@ -46,9 +320,10 @@ class Dispatcher(object):
         state paired with the event type. Any args/kwargs are passed to the
         listeners
         """
-        typed_listeners = self.listeners[(game_data.state.state, event.type)]
-        untyped_listeners = self.listeners[(game_data.state.state, None)]
-        listeners = typed_listeners | untyped_listeners
+        key = (game_data.state.state, event.type)
+        listeners = self._resolved.get(key)
+        if listeners is None:
+            listeners = self.resolve_listeners(*key)
         for listener in listeners:
             listener(event, game_data, *args, **kwargs)
 
@@ -57,13 +332,115 @@ class Dispatcher(object):
         Given the `game_data` and any args/kwargs, dispatch pygame events to
         the registered listeners for the current state based on the event_type
         """
-        for event in self.event_queue():
-            self.dispatch(event, game_data, *args, **kwargs)
+        if self.event_filter is not None:
+            self.update_event_filter(game_data.state.state)
+        input_state = self._input_state
+        if input_state is None:
+            for event in self.event_queue():
+                self.dispatch(event, game_data, *args, **kwargs)
+        else:
+            input_state.begin_frame()
+            for event in self.event_queue():
+                input_state.update(event)
+                self.dispatch(event, game_data, *args, **kwargs)
+
+    def allowed_event_types(self, state):
+        """
+        Returns the set of event types that have listeners registered for the
+        given `state` (or its parent states) or are needed by the input state,
+        or None if the state has a listener registered without an event type,
+        since that listener must see every event.
+        """
+        path = state_path(state)
+        event_types = set()
+        for (listener_state, event_type), listeners in self.listeners.items():
+            if listener_state in path and listeners:
+                if event_type is None:
+                    return None
+                event_types.add(event_type)
+        if self._input_state is not None:
+            event_types.update(self._input_state.event_types)
+        return event_types
+
+    def update_event_filter(self, state):
+        """
+        Applies the event filter for the given `state` if the state or the
+        registered listeners changed since it was last applied.
+        """
+        if self._filter_stale or state != self._filtered_state:
+            self.event_filter(self.allowed_event_types(state))
+            self._filtered_state = state
+            self._filter_stale = False
+
+    def enable_profiling(self, frame_budget=None, timer=default_timer):
+        """
+        Starts timing every listener call and returns the DispatchProfiler
+        that holds the results. Profiling swaps in instrumented versions of
+        `dispatch` and `handle_events`, so a dispatcher that is not profiled
+        pays nothing for it.
+        """
+        self.profiler = DispatchProfiler(frame_budget, timer)
+        self.dispatch = self._profiled_dispatch
+        self.handle_events = self._profiled_handle_events
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stops profiling and returns the DispatchProfiler, if any"""
+        profiler, self.profiler = self.profiler, None
+        self.__dict__.pop('dispatch', None)
+        self.__dict__.pop('handle_events', None)
+        return profiler
+
+    def _profiled_dispatch(self, event, game_data, *args, **kwargs):
+        """A version of `dispatch` that times each listener call"""
+        state = game_data.state.state
+        listeners = self.resolve_listeners(state, event.type)
+        profiler = self.profiler
+        timer = profiler.timer
+        for listener in listeners:
+            start = timer()
+            listener(event, game_data, *args, **kwargs)
+            profiler.record(listener, state, event.type, timer() - start)
+
+    def _profiled_handle_events(self, game_data, *args, **kwargs):
+        """A version of `handle_events` that closes the profiler's frame"""
+        Dispatcher.handle_events(self, game_data, *args, **kwargs)
+        self.profiler.end_frame()
 
 
 def get_pygame_event_queue():
     return pygame.event.get()
 
 
+# Event types that are never blocked, since the application has to see them
+# whether or not the current state listens for them: quitting and every window
+# event (pygame 2 has a separate event type for each, such as WINDOWCLOSE and
+# WINDOWFOCUSLOST)
+ALWAYS_ALLOWED_EVENT_TYPES = frozenset(
+    getattr(pygame, name) for name in dir(pygame)
+    if name in ('QUIT', 'ACTIVEEVENT', 'VIDEORESIZE', 'VIDEOEXPOSE')
+    or name.startswith('WINDOW')
+)
+
+
+def set_pygame_event_filter(event_types):
+    """
+    Allows only the given `event_types`, and the ALWAYS_ALLOWED_EVENT_TYPES,
+    onto the pygame event queue, or every event type if `event_types` is
+    None. Blocked events are discarded by pygame and never reach the Python
+    side.
+    """
+    if event_types is None:
+        pygame.event.set_allowed(None)
+    else:
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(
+            list(set(event_types) | ALWAYS_ALLOWED_EVENT_TYPES)
+        )
+
+
+# Events are not filtered by default, since blocked events are lost to the
+# rest of the application. To drop the events no listener wants, set
+# dispatcher.event_filter = set_pygame_event_filter
 dispatcher = Dispatcher(get_pygame_event_queue)
 
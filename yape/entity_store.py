@@ -0,0 +1,200 @@
+# numpy is optional, and only needed for EntityStore
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Marks a ColumnField that has no class level default
+NO_DEFAULT = object()
+
+
+def _to_column_value(value, dtype, name):
+    """
+    Returns `value` converted to `dtype` for the column `name`. Raises
+    ValueError if the conversion would change the value, as when None or a
+    string would become nan, or a float would be truncated to an integer.
+    Floats may still be rounded to the precision of a float column.
+    """
+    try:
+        converted = numpy.asarray(value, dtype)
+    except (TypeError, ValueError, OverflowError):
+        converted = None
+    if converted is not None:
+        if dtype.kind == 'f':
+            if isinstance(value, (int, long, float, numpy.number)):
+                return converted
+        elif converted.item() == value:
+            return converted
+    err_msg = u'{0!r} can not be stored in the {1} column {2}'
+    raise ValueError(err_msg.format(value, dtype, name))
+
+
+class ColumnField(object):
+    """
+    A data descriptor for a numeric field of a component class. While the
+    component belongs to an EntityStore with a column for the field, the value
+    is read from and written to the component's row of that column. Otherwise
+    it is an ordinary instance attribute, falling back to the `default` that
+    the class defined before the descriptor replaced it. Component classes
+    get one for each field named in their `column_fields`.
+    """
+
+    def __init__(self, name, default=NO_DEFAULT):
+        self.name = name
+        self.default = default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        instance_dict = instance.__dict__
+        store = instance_dict.get('_entity_store')
+        if store is not None and self.name in store.columns:
+            return store.columns[self.name][instance_dict['_entity_row']].item()
+        try:
+            return instance_dict[self.name]
+        except KeyError:
+            if self.default is NO_DEFAULT:
+                raise AttributeError(self.name)
+            return self.default
+
+    def __set__(self, instance, value):
+        instance_dict = instance.__dict__
+        store = instance_dict.get('_entity_store')
+        if store is not None and self.name in store.columns:
+            column = store.columns[self.name]
+            column[instance_dict['_entity_row']] = _to_column_value(
+                value, column.dtype, self.name
+            )
+        else:
+            instance_dict[self.name] = value
+
+    def __delete__(self, instance):
+        try:
+            del instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+
+class EntityStore(object):
+    """
+    Keeps the chosen numeric fields of many components in NumPy arrays, one
+    array ("column") per field and one row per component. `fields` is a list
+    of field names, stored with the given `dtype`, or a dictionary of field
+    names to their dtypes.
+
+    Components added to the store become views onto their row, so code that
+    reads or assigns `component.x` keeps working, while systems update every
+    entity at once through the columns. The class of each component must
+    list the stored fields in its `column_fields`:
+
+        class Ball(Component):
+            column_fields = ['x', 'y', 'vx', 'vy']
+
+        store = EntityStore(['x', 'y', 'vx', 'vy'])
+        for entity in entities:
+            store.add(entity)
+        store.column('x')[:] += store.column('vx') * dt
+
+    The arrays are reallocated as the store grows, so fetch columns again
+    after adding components rather than holding on to them.
+    """
+
+    def __init__(self, fields, capacity=64, dtype='float64'):
+        if numpy is None:
+            raise ImportError('EntityStore requires numpy')
+        if not hasattr(fields, 'items'):
+            fields = dict((name, dtype) for name in fields)
+        self.columns = dict(
+            (name, numpy.zeros(max(capacity, 1), dtype=field_dtype))
+            for name, field_dtype in fields.items()
+        )
+        # The component of each row, in row order
+        self.components = []
+
+    def __len__(self):
+        return len(self.components)
+
+    def __contains__(self, component):
+        return component.__dict__.get('_entity_store') is self
+
+    @property
+    def capacity(self):
+        return len(next(self.columns.itervalues()))
+
+    def column(self, name):
+        """Returns a view of the column `name` that covers every component"""
+        return self.columns[name][:len(self.components)]
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for name, column in self.columns.items():
+            grown = numpy.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+
+    def add(self, component):
+        """
+        Moves the stored fields of `component` into a new row, which it then
+        acts as a view onto. Fields the component doesn't have start as their
+        class level default, or 0. Raises ValueError if a field isn't one of
+        the class's `column_fields`, or its value doesn't fit its column.
+        """
+        if component.__dict__.get('_entity_store') is not None:
+            raise ValueError('The component already belongs to an EntityStore')
+        cls = type(component)
+        for name in self.columns:
+            if not isinstance(getattr(cls, name, None), ColumnField):
+                err_msg = u'{0} does not declare {1} in its column_fields'
+                raise ValueError(err_msg.format(cls.__name__, name))
+        # Convert every value before changing anything, so a value that
+        # doesn't fit its column leaves the component as it was
+        values = dict(
+            (name, _to_column_value(
+                getattr(component, name, 0), column.dtype, name
+            ))
+            for name, column in self.columns.items()
+        )
+        row = len(self.components)
+        if row == self.capacity:
+            self._grow()
+        instance_dict = component.__dict__
+        for name, column in self.columns.items():
+            column[row] = values[name]
+            instance_dict.pop(name, None)
+        instance_dict['_entity_store'] = self
+        instance_dict['_entity_row'] = row
+        self.components.append(component)
+        return row
+
+    def add_many(self, components):
+        """Adds each of the given components"""
+        for component in components:
+            self.add(component)
+
+    def remove(self, component):
+        """
+        Removes `component` from the store, copying its stored fields back to
+        ordinary attributes. The last row is moved into the freed row, so
+        removal takes constant time but does not preserve row order.
+        """
+        if component not in self:
+            raise ValueError('The component does not belong to this store')
+        instance_dict = component.__dict__
+        row = instance_dict.pop('_entity_row')
+        del instance_dict['_entity_store']
+        for name, column in self.columns.items():
+            instance_dict[name] = column[row].item()
+        last = len(self.components) - 1
+        moved = self.components.pop()
+        if row != last:
+            for column in self.columns.values():
+                column[row] = column[last]
+            self.components[row] = moved
+            moved.__dict__['_entity_row'] = row
+
+    def row_of(self, component):
+        """Returns the row of `component` in the store"""
+        if component not in self:
+            raise ValueError('The component does not belong to this store')
+        return component.__dict__['_entity_row']
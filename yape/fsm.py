@@ -1,8 +1,260 @@
-from functools import partial
-from collections import defaultdict
+import sys
+import weakref
+from collections import defaultdict, deque
+from timeit import default_timer
 
 
-class FSM(object):
+# Separates the names of nested states, e.g. 'game.dialogue' is a substate of
+# 'game'
+SUBSTATE_SEPARATOR = '.'
+
+# Caches the path of each state seen by state_path
+_state_paths = {}
+
+
+def state_path(state):
+    """
+    Returns a tuple of the given `state` followed by each of its parent
+    states, innermost first. For example, 'game.menu.options' has the path
+    ('game.menu.options', 'game.menu', 'game'). States that aren't strings
+    have no parents. Paths are computed once per state and cached.
+    """
+    try:
+        return _state_paths[state]
+    except KeyError:
+        pass
+    path = [state]
+    if isinstance(state, basestring):
+        parent = state
+        while SUBSTATE_SEPARATOR in parent:
+            parent = parent.rsplit(SUBSTATE_SEPARATOR, 1)[0]
+            path.append(parent)
+    path = _state_paths[state] = tuple(path)
+    return path
+
+
+# Functions called with (machine, source, name, destination) after every
+# transition of every machine. See add_transition_hook
+transition_hooks = []
+
+# Every TransitionTrace that is still in use by id, for dump_traces
+_live_traces = weakref.WeakValueDictionary()
+
+
+def add_transition_hook(hook):
+    """
+    Registers `hook` to be called with the machine, source state, transition
+    name and destination state after each transition of any machine. While no
+    hooks are registered, transitions only pay for checking an empty list.
+    """
+    transition_hooks.append(hook)
+
+
+def remove_transition_hook(hook):
+    """Unregisters a hook registered with `add_transition_hook`"""
+    transition_hooks.remove(hook)
+
+
+def _call_hooks(machine, source, name, destination):
+    for hook in list(transition_hooks):
+        hook(machine, source, name, destination)
+
+
+class TransitionTrace(object):
+    """
+    A fixed-size ring buffer of the most recent transitions of a machine, as
+    (timestamp, source, transition, destination, duration) tuples where
+    `duration` is the time spent in the transition and its callbacks. Once
+    `size` transitions are recorded, each new one replaces the oldest.
+    """
+
+    def __init__(self, size=64, name=None, timer=default_timer):
+        self.records = deque(maxlen=size)
+        self.name = name
+        self.timer = timer
+        _live_traces[id(self)] = self
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def clear(self):
+        self.records.clear()
+
+    def dump(self, stream=None):
+        """Writes the recorded transitions to `stream`, or to stderr"""
+        stream = stream or sys.stderr
+        stream.write(u'Transition trace {0}\n'.format(self.name or id(self)))
+        for timestamp, source, name, destination, duration in self.records:
+            stream.write(u'  {0:.6f} {1} -> {2} -> {3} ({4:.6f}s)\n'.format(
+                timestamp, source, name, destination, duration
+            ))
+
+
+def dump_traces(stream=None):
+    """Dumps every TransitionTrace that is in use to `stream`, or stderr"""
+    for trace in _live_traces.values():
+        trace.dump(stream)
+
+
+def install_crash_dump(stream=None):
+    """
+    Wraps `sys.excepthook` so that every TransitionTrace in use is dumped to
+    `stream` (or stderr) when an uncaught exception ends the program
+    """
+    previous_hook = sys.excepthook
+
+    def excepthook(*exc_info):
+        dump_traces(stream)
+        previous_hook(*exc_info)
+    sys.excepthook = excepthook
+    return excepthook
+
+
+def _find_destination(destinations, state):
+    """
+    Returns the destination in `destinations` for the innermost state on the
+    path of `state` that is a source, or None if there is none
+    """
+    for source in state_path(state):
+        destination = destinations.get(source)
+        if destination is not None:
+            return destination
+    return None
+
+
+def _compile_transition(name, destinations, callbacks):
+    """
+    Returns a function that performs the transition `name` on the machine it
+    is called with. `destinations` maps each source of the transition to its
+    destination and may be updated in place afterwards. The callbacks for the
+    transition are looked up now, so the function must be compiled again when
+    `callbacks` changes.
+
+    When called, the function validates that the transition is possible from
+    the current state or one of its parent states, calls the 'on_before_'
+    callback, which can short circuit the transition by returning a falsy
+    value, then moves to the destination and returns the result of the 'on_'
+    callback. If the machine has callbacks, but none for this transition,
+    True is returned. Any transition hooks are called once the transition is
+    complete.
+    """
+    def illegal(machine):
+        err_msg = '{0} called when current state was {1}'
+        return machine.IllegalTransitionException(
+            err_msg.format(name, machine.state)
+        )
+
+    if not callbacks:
+        def transition(machine, *args, **kwargs):
+            source = machine.state
+            destination = destinations.get(source)
+            if destination is None:
+                destination = _find_destination(destinations, source)
+                if destination is None:
+                    raise illegal(machine)
+            machine.state = destination
+            if transition_hooks:
+                _call_hooks(machine, source, name, destination)
+        return transition
+
+    before = callbacks.get('on_before_' + name) or None
+    after = callbacks.get('on_' + name) or None
+
+    def transition(machine, *args, **kwargs):
+        source = machine.state
+        destination = destinations.get(source)
+        if destination is None:
+            destination = _find_destination(destinations, source)
+            if destination is None:
+                raise illegal(machine)
+        if before is None or before(*args, **kwargs):
+            machine.state = destination
+            result = True if after is None else after(*args, **kwargs)
+            if transition_hooks:
+                _call_hooks(machine, source, name, destination)
+            return result
+    return transition
+
+
+def _trace_transition(name, transition, trace):
+    """
+    Wraps a compiled `transition` so that each call is recorded in `trace`,
+    including one that raises, so that a crash dump shows the transition that
+    crashed. A transition short circuited by its 'on_before_' callback is
+    recorded with its source as the destination.
+    """
+    timer = trace.timer
+    record = trace.records.append
+
+    def traced(machine, *args, **kwargs):
+        source = machine.state
+        start = timer()
+        try:
+            return transition(machine, *args, **kwargs)
+        finally:
+            record((start, source, name, machine.state, timer() - start))
+    return traced
+
+
+class BaseFSM(object):
+    """
+    Behavior shared by FSM and the machines created from an FSMDefinition.
+    Subclasses provide `state`, `possible_states`, `transitions`, `callbacks`
+    and `_source_to_names`, either per instance or on the class.
+    """
+
+    __slots__ = ()
+
+    class IllegalNameException(Exception):
+        pass
+
+    class IllegalCallbackException(Exception):
+        pass
+
+    class IllegalTransitionException(Exception):
+        pass
+
+    def is_state(self, check_state):
+        """Checks if the current state is `check_state`"""
+        return self.state == check_state
+
+    def is_in(self, check_state):
+        """Checks if the current state is `check_state` or a substate of it"""
+        return check_state in state_path(self.state)
+
+    def can(self, name):
+        """
+        Checks if the given `name` is a possible transition from the current
+        state or one of its parent states
+        """
+        source_to_names = self._source_to_names
+        for state in state_path(self.state):
+            names = source_to_names.get(state)
+            if names and name in names:
+                return True
+        return False
+
+    def __repr__(self):
+        return u'State machine: ({0}) '.format(self.state) + u' '.join([
+            state
+            for state in self.possible_states
+            if state != self.state
+        ])
+
+    def callbacks_display(self):
+        return self.callbacks.keys()
+
+    def transitions_display(self):
+        return sorted([
+            '{0}: {1} -> {2}'.format(name, source, destination)
+            for (source, name), destination in self.transitions.items()
+        ])
+
+
+class FSM(BaseFSM):
     """
     A simple finite state machine that defines a set of states and the
     transitions between those states. The constructor takes the name of the
@@ -23,16 +275,18 @@ class FSM(object):
     to the associated callback(s) for the transition. In the above example, a
     call to fms.enter(score=10), would pass the score=10 kwarg to the
     `on_enter` and `on_before_enter` for handling.
-    """
 
-    class IllegalNameException(Exception):
-        pass
+    States may be nested by separating their names with a '.'. A substate such
+    as 'game.dialogue' inherits the transitions of its parent 'game', unless it
+    defines a transition of the same name itself. The Dispatcher likewise
+    calls listeners registered for 'game' while in 'game.dialogue'.
 
-    class IllegalCallbackException(Exception):
-        pass
+    To create many machines with the same transitions and callbacks, use an
+    FSMDefinition instead.
 
-    class IllegalTransitionException(Exception):
-        pass
+    `enable_trace` keeps a TransitionTrace of the most recent transitions in
+    `trace`, which costs nothing while it is disabled.
+    """
 
     def __init__(self, initial, transitions=None, callbacks=None):
         callbacks = callbacks or {}
@@ -48,9 +302,25 @@ class FSM(object):
         self.transitions = {}
         # Maintains the mapping of each source to the list of possible transitions
         self._source_to_names = defaultdict(set)
+        # Maintains the mapping of each transition name to its sources and
+        # their destinations. Shared with the compiled transition functions
+        self._destinations = {}
+        # The TransitionTrace of recent transitions, if tracing is enabled
+        self.trace = None
         map(self.add_transition, transitions)
         map(lambda k_v: self.add_callback(*k_v), callbacks.items())
 
+    def _is_reserved(self, name):
+        """
+        Checks if `name` is an attribute of the machine (other than a
+        transition), and so is not available as a transition name
+        """
+        if name in self._destinations:
+            return False
+        if name in self.__dict__:
+            return True
+        return any(name in vars(kls) for kls in type(self).__mro__)
+
     def add_transition(self, transition):
         """
         Given a transition dictionary that defines a `source`, `name`, and
@@ -63,11 +333,7 @@ class FSM(object):
         source, name = transition['source'], transition['name']
         destination = transition['destination']
         # Assure transition names won't override existing methods
-        transition_names = [
-            t_name for t_source, t_name in self.transitions.keys()
-        ]
-        reserved_methods = set(dir(self)).difference(transition_names)
-        if name in reserved_methods:
+        if self._is_reserved(name):
             err_msg = u'The transition name `{0}` shadows an existing method'
             raise self.IllegalNameException(err_msg.format(name))
         # Assure transition won't override an existing one. (Transitions are
@@ -85,10 +351,36 @@ class FSM(object):
         self._source_to_names[source].add(name)
         self.possible_states.add(source)
         self.possible_states.add(destination)
-        if not hasattr(self, name):
-            # Create a function for the transition
-            func = partial(self._transition_function_factory, source, name)
-            setattr(self, name, func)
+        if name in self._destinations:
+            # The compiled transition sees the new source through this dict
+            self._destinations[name][source] = destination
+        else:
+            self._destinations[name] = {source: destination}
+            self._compile(name)
+
+    def _compile(self, name):
+        """(Re)creates the method for the transition `name`"""
+        func = _compile_transition(
+            name, self._destinations[name], self.callbacks
+        )
+        if self.trace is not None:
+            func = _trace_transition(name, func, self.trace)
+        setattr(self, name, func.__get__(self, type(self)))
+
+    def enable_trace(self, size=64, name=None):
+        """
+        Starts recording the last `size` transitions in a new TransitionTrace,
+        which is stored in `trace` and returned. `name` identifies the trace
+        when it is dumped.
+        """
+        self.trace = TransitionTrace(size, name)
+        map(self._compile, self._destinations)
+        return self.trace
+
+    def disable_trace(self):
+        """Stops recording transitions and discards the trace"""
+        self.trace = None
+        map(self._compile, self._destinations)
 
     def add_callback(self, name, func):
         """
@@ -104,75 +396,139 @@ class FSM(object):
         transition_name = name[3:]
         if transition_name.startswith('before_'):
             transition_name = transition_name[7:]
-        transition_names = [
-            t_name for t_source, t_name in self.transitions.keys()
-        ]
-        if transition_name not in transition_names:
+        if transition_name not in self._destinations:
             err_msg = u'Callback {0} can not be registered because {1} is not a transition name'
             raise self.IllegalCallbackException(
                 err_msg.format(name, transition_name)
             )
+        had_callbacks = bool(self.callbacks)
         self.callbacks.update({
             name: func
         })
-
-    def _transition_function_factory(self, source, name, *args, **kwargs):
-        """
-        Given an existing transition's `source` and `name` create a method with
-        that name, that moves the state from the source to the destination
-        state. When called, validates that the current state is the source
-        state, and calls any registered callbacks for the transition.
-        """
-        destination = self.transitions.get((source, name), None)
-        if destination is not None and self.can(name):
-            if self.callbacks:
-                resume = self._call_callback(name, 'before', *args, **kwargs)
-                if resume:
-                    self.state = destination
-                    return self._call_callback(name, '', *args, **kwargs)
-            else:
-                self.state = destination
+        # Transitions behave differently once the machine has any callbacks
+        if had_callbacks:
+            self._compile(transition_name)
         else:
-            err_msg = '{0} called when current state was {1}'
-            raise self.IllegalTransitionException(
-                err_msg.format(name, self.state)
-            )
+            map(self._compile, self._destinations)
 
-    def _call_callback(self, transition_name, prefix, *args, **kwargs):
-        """Calls the callback on behalf of the transition function"""
-        if prefix:
-            name_parts = ('on', prefix, transition_name)
-        else:
-            name_parts = ('on', transition_name)
-        callback_name = '_'.join(name_parts)
-        callback = self.callbacks.get(callback_name, None)
-        if callback:
-            return callback(*args, **kwargs)
-        return True
 
-    def is_state(self, check_state):
-        """Checks if the current state is `check_state`"""
-        return self.state == check_state
+class CompiledFSM(BaseFSM):
+    """
+    Base class of the machine classes created by FSMDefinition. The
+    transitions, callbacks and indexes live on the class, so an instance only
+    stores its current state.
+    """
 
-    def can(self, name):
-        """
-        Checks if the given `name` is a possible transition from the current
-        state
-        """
-        return name in self._source_to_names[self.state]
+    __slots__ = ('state',)
 
-    def __repr__(self):
-        return u'State machine: ({0}) '.format(self.state) + u' '.join([
-            state
-            for state in self.possible_states
-            if state != self.state
-        ])
+    # Set on each machine class by its FSMDefinition
+    definition = None
+    transitions = {}
+    callbacks = {}
+    _source_to_names = {}
+    _states = frozenset()
 
-    def callbacks_display(self):
-        return self.callbacks.keys()
+    def __init__(self, initial):
+        self.state = initial
 
-    def transitions_display(self):
-        return sorted([
-            '{0}: {1} -> {2}'.format(name, source, destination)
-            for (source, name), destination in self.transitions.items()
-        ])
+    @property
+    def possible_states(self):
+        if self.state in self._states:
+            return self._states
+        return self._states | set([self.state])
+
+
+class FSMDefinition(object):
+    """
+    A state machine definition that is validated and compiled once, then
+    shared by every machine created from it. Takes a list of transitions and a
+    dictionary of callbacks as described on FSM, and builds a machine class
+    with a method per transition. Calling the definition with an initial state
+    returns a new machine, which stores nothing but its state:
+
+        guard = FSMDefinition(transitions, callbacks)
+        machines = [guard('idle') for _ in xrange(5000)]
+
+    The definition is immutable; machines created from it support everything
+    FSM does except `add_transition`, `add_callback` and tracing, since they
+    have nowhere to keep a trace. Use an FSM to trace a machine.
+
+    If a default `initial` state is given, the states that can never be
+    reached from it are found up front and kept in `unreachable_states`.
+    `dead_states` holds the states that have no transitions out of them,
+    either their own or inherited from a parent state.
+    """
+
+    def __init__(self, transitions=None, callbacks=None,
+            class_name='CompiledFSM', initial=None):
+        # Validate the transitions and callbacks exactly as FSM does, then
+        # take the resulting indexes from the prototype machine
+        prototype = FSM(None, transitions, callbacks)
+        prototype.possible_states.discard(None)
+        for attr in dir(CompiledFSM):
+            if attr in prototype._destinations:
+                err_msg = u'The transition name `{0}` shadows an existing method'
+                raise FSM.IllegalNameException(err_msg.format(attr))
+        self.transitions = prototype.transitions
+        self.callbacks = prototype.callbacks
+        self.possible_states = frozenset(prototype.possible_states)
+        source_to_names = dict(
+            (source, frozenset(names))
+            for source, names in prototype._source_to_names.items()
+        )
+        attrs = {
+            '__slots__': (),
+            'definition': self,
+            'transitions': self.transitions,
+            'callbacks': self.callbacks,
+            '_source_to_names': source_to_names,
+            '_states': self.possible_states,
+        }
+        for name, destinations in prototype._destinations.items():
+            attrs[name] = _compile_transition(
+                name, destinations, self.callbacks
+            )
+        self.machine_class = type(class_name, (CompiledFSM,), attrs)
+        # Analyze the graph of states once, rather than at runtime
+        self.initial = initial
+        self.dead_states = frozenset(
+            state for state in self.possible_states
+            if not any(
+                source in source_to_names for source in state_path(state)
+            )
+        )
+        if initial is None:
+            self.unreachable_states = frozenset()
+        else:
+            self.unreachable_states = self.possible_states.difference(
+                self.reachable_from(initial)
+            )
+
+    def reachable_from(self, state):
+        """
+        Returns the set of states that can be reached from `state` through any
+        number of transitions, including `state` itself. Being in a substate
+        means being in each of its parent states, so those are included too.
+        """
+        destinations = defaultdict(set)
+        for (source, name), destination in self.transitions.items():
+            destinations[source].add(destination)
+        reachable = set(state_path(state))
+        pending = [state]
+        while pending:
+            # A state can take the transitions of each of its parents
+            for source in state_path(pending.pop()):
+                for destination in destinations[source]:
+                    if destination not in reachable:
+                        reachable.update(state_path(destination))
+                        pending.append(destination)
+        return reachable
+
+    def __call__(self, initial=None):
+        """
+        Returns a new machine in the `initial` state, or in the definition's
+        default initial state if none is given
+        """
+        if initial is None:
+            initial = self.initial
+        return self.machine_class(initial)
@@ -0,0 +1,108 @@
+import pygame
+
+
+class InputState(object):
+    """
+    A snapshot of the keyboard and mouse that is updated from the events of
+    each frame, so game code can poll it instead of tracking held keys with
+    KEYDOWN/KEYUP listeners. Keys and mouse buttons are stored as bitsets:
+
+    `keys_down`/`buttons_down` hold what is currently held, while
+    `keys_pressed`/`keys_released` and `buttons_pressed`/`buttons_released`
+    hold what changed during the current frame. `mouse_pos` is the last known
+    position of the mouse.
+
+    Pass an instance to a Dispatcher to have `handle_events` update it once per
+    frame.
+    """
+
+    def __init__(self):
+        self.keys_down = 0
+        self.keys_pressed = 0
+        self.keys_released = 0
+        self.buttons_down = 0
+        self.buttons_pressed = 0
+        self.buttons_released = 0
+        self.mouse_pos = (0, 0)
+        # Maps each key code to its bit. Key codes can be very large, so they
+        # are given bits in the order they are first seen
+        self._key_bits = {}
+        self._handlers = {
+            pygame.KEYDOWN: self._key_down,
+            pygame.KEYUP: self._key_up,
+            pygame.MOUSEBUTTONDOWN: self._button_down,
+            pygame.MOUSEBUTTONUP: self._button_up,
+            pygame.MOUSEMOTION: self._mouse_motion,
+        }
+        # The event types the input state needs to see
+        self.event_types = frozenset(self._handlers)
+
+    def key_bit(self, key):
+        """Returns the bit that represents `key` in the key bitsets"""
+        bit = self._key_bits.get(key)
+        if bit is None:
+            bit = self._key_bits[key] = 1 << len(self._key_bits)
+        return bit
+
+    def begin_frame(self):
+        """Clears the pressed and released keys and buttons of the last frame"""
+        self.keys_pressed = self.keys_released = 0
+        self.buttons_pressed = self.buttons_released = 0
+
+    def update(self, event):
+        """Updates the input state from the given pygame event"""
+        handler = self._handlers.get(event.type)
+        if handler is not None:
+            handler(event)
+
+    def _key_down(self, event):
+        bit = self.key_bit(event.key)
+        # Repeated KEYDOWN events for a held key are not new presses
+        if not self.keys_down & bit:
+            self.keys_pressed |= bit
+        self.keys_down |= bit
+
+    def _key_up(self, event):
+        bit = self.key_bit(event.key)
+        self.keys_released |= bit
+        self.keys_down &= ~bit
+
+    def _button_down(self, event):
+        bit = 1 << event.button
+        if not self.buttons_down & bit:
+            self.buttons_pressed |= bit
+        self.buttons_down |= bit
+        self.mouse_pos = event.pos
+
+    def _button_up(self, event):
+        bit = 1 << event.button
+        self.buttons_released |= bit
+        self.buttons_down &= ~bit
+        self.mouse_pos = event.pos
+
+    def _mouse_motion(self, event):
+        self.mouse_pos = event.pos
+
+    def is_key_down(self, key):
+        """Checks if `key` is currently held"""
+        return bool(self.keys_down & self.key_bit(key))
+
+    def was_key_pressed(self, key):
+        """Checks if `key` went down during the current frame"""
+        return bool(self.keys_pressed & self.key_bit(key))
+
+    def was_key_released(self, key):
+        """Checks if `key` went up during the current frame"""
+        return bool(self.keys_released & self.key_bit(key))
+
+    def is_button_down(self, button):
+        """Checks if the mouse `button` is currently held"""
+        return bool(self.buttons_down & (1 << button))
+
+    def was_button_pressed(self, button):
+        """Checks if the mouse `button` went down during the current frame"""
+        return bool(self.buttons_pressed & (1 << button))
+
+    def was_button_released(self, button):
+        """Checks if the mouse `button` went up during the current frame"""
+        return bool(self.buttons_released & (1 << button))
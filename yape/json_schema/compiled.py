@@ -0,0 +1,311 @@
+"""Schemas compiled into validator functions.
+
+Comparing token streams allocates a token for every part of the input, and
+every comparison walks the context chains of both tokens. A compiled
+validator is a tree of functions, built once from the schema definition, that
+walks the input data directly instead.
+
+Token comparison has a few quirks that a validator has to reproduce: tokens
+other than value tokens and metatokens only compare their depth, and streams
+of different lengths are only compared as far as the shorter one goes. Rather
+than emulating all of that, a validator answers True when the token
+comparison would certainly succeed, False when it would certainly fail at a
+token it has reached, and None when only the token comparison can tell. The
+data is certainly valid when it has the exact shape of the schema and each
+value matches, which covers nearly all real data.
+
+>>> from yape.json_schema.defs import AnyString
+>>> validator = compile_validator({u"name": AnyString, u"size": [1, 2]})
+>>> validator({u"name": u"crate", u"size": [1, 2]})
+True
+>>> validator({u"name": 3, u"size": [1, 2]})
+False
+>>> validator({u"name": u"crate", u"size": [1, 2, 3]}) is None
+True
+"""
+
+from itertools import izip
+
+from yape.json_schema.tokens import (
+    BadInputValue, MappingToken, MapKeyToken, MapValueToken, MetaTokenType,
+    SequenceToken, ValueToken, map_types, sequence_types, token_stream,
+    token_value_map, valuetoken_type_map,
+)
+
+
+def has_predicate(metatoken):
+    """Return whether *metatoken* defines its own predicate."""
+    return (
+        getattr(metatoken.predicate, "im_func", None)
+        is not MetaTokenType.__dict__["predicate"]
+    )
+
+
+def bulk_item_types(schema):
+    """Return the types of the values that *schema* matches by type alone.
+
+    That is the case for a metatoken without a predicate, which matches a
+    value token by its class alone. A value of any of the returned types
+    matches the metatoken, so a whole array can be checked by the set of its
+    item types instead of item by item. Return None for other schemas.
+    """
+    if type(schema) is not MetaTokenType or has_predicate(schema):
+        return None
+    return frozenset(
+        typ for typ, token_class in valuetoken_type_map.items()
+        if issubclass(token_class, schema.matching_token_types)
+    )
+
+
+def _single_token_class(value):
+    """
+    Returns the class of the token that *value* is streamed as, if it is
+    streamed as exactly one token, otherwise None.
+    """
+    token_class = valuetoken_type_map.get(type(value))
+    if token_class is None and (value is None or value is True
+                                or value is False):
+        token_class = token_value_map[value]
+    return token_class
+
+
+def _compile_value(expected):
+    """A value token matches value tokens with an equal value."""
+    def validate(value):
+        if type(value) in valuetoken_type_map:
+            return value == expected
+        return None
+    return validate
+
+
+def _compile_token():
+    """Null, true and false tokens match any token at the same depth."""
+    def validate(value):
+        if _single_token_class(value) is not None:
+            return True
+        return None
+    return validate
+
+
+def _compile_meta(metatoken, context):
+    """Metatokens match tokens of their types that satisfy their predicate."""
+    matching = metatoken.matching_token_types
+    custom_predicate = has_predicate(metatoken)
+    # Without a predicate, whether a value matches depends only on its type
+    matches_type = dict(
+        (typ, issubclass(token_class, matching))
+        for typ, token_class in valuetoken_type_map.items()
+    )
+
+    def validate(value):
+        if not custom_predicate:
+            result = matches_type.get(type(value))
+            if result is not None:
+                return result
+        token_class = _single_token_class(value)
+        if token_class is None:
+            typ = type(value)
+            if typ in sequence_types:
+                token_class = SequenceToken
+            elif typ in map_types:
+                token_class = MappingToken
+            else:
+                return None
+            # A matching container is compared token by token from here
+            if issubclass(token_class, matching):
+                return None
+            return False
+        if not issubclass(token_class, matching):
+            return False
+        if not custom_predicate:
+            return True
+        if issubclass(token_class, ValueToken):
+            token = token_class(value, context)
+        else:
+            token = token_class(context)
+        return bool(metatoken.predicate(token))
+    return validate
+
+
+def _compile_sequence(schema, context):
+    token = SequenceToken(context)
+    items = [compile_validator(item, token) for item in schema]
+    count = len(items)
+    # Token comparison gives an array one schema token per item, so only a
+    # fixed-length array of one type, such as [AnyInteger] * 64 for a tile
+    # layer of known size, is checked in bulk here. Arrays of any length,
+    # [AnyInteger], are checked in bulk by compile_checker instead
+    item_types = None
+    if schema and all(item is schema[0] for item in schema):
+        item_types = bulk_item_types(schema[0])
+
+    def validate(value):
+        if type(value) not in sequence_types:
+            return None
+        if (item_types is not None and len(value) == count
+                and set(map(type, value)) <= item_types):
+            return True
+        for validate_item, item in izip(items, value):
+            result = validate_item(item)
+            if result is not True:
+                return result
+        if len(value) != count:
+            return None
+        return True
+    return validate
+
+
+def _compile_mapping(schema, context):
+    token = MappingToken(context)
+    key_context = MapKeyToken(token)
+    value_context = MapValueToken(token)
+    # Mappings are streamed in sorted key order
+    items = [
+        (
+            compile_validator(key, key_context),
+            compile_validator(subvalue, value_context),
+        )
+        for key, subvalue in sorted(schema.items())
+    ]
+    count = len(items)
+
+    def validate(value):
+        if type(value) not in map_types:
+            return None
+        keys = sorted(value)
+        for (validate_key, validate_value), key in izip(items, keys):
+            result = validate_key(key)
+            if result is not True:
+                return result
+            result = validate_value(value[key])
+            if result is not True:
+                return result
+        if len(keys) != count:
+            return None
+        return True
+    return validate
+
+
+def compile_validator(schema, context=None):
+    """Compile the schema definition *schema* into a validator function.
+
+    The validator takes a value and returns True if validating the value
+    against the schema's tokens would succeed, False if it would fail, or None
+    if that can't be determined without comparing the tokens.
+    """
+    typ = type(schema)
+    if typ in sequence_types:
+        return _compile_sequence(schema, context)
+    elif typ in map_types:
+        return _compile_mapping(schema, context)
+    elif typ in valuetoken_type_map:
+        return _compile_value(schema)
+    elif typ is MetaTokenType:
+        return _compile_meta(schema, context)
+    return _compile_token()
+
+
+def metatoken_matches(metatoken, value):
+    """Return whether the first token of *value* matches *metatoken*."""
+    try:
+        token = token_stream(value).next()
+    except BadInputValue:
+        return False
+    return metatoken == token
+
+
+def _check_meta(metatoken):
+    custom_predicate = has_predicate(metatoken)
+    matches_type = dict(
+        (typ, issubclass(token_class, metatoken.matching_token_types))
+        for typ, token_class in valuetoken_type_map.items()
+    )
+
+    def check(value):
+        if not custom_predicate:
+            result = matches_type.get(type(value))
+            if result is not None:
+                return result
+        return metatoken_matches(metatoken, value)
+    return check
+
+
+def _check_sequence(schema):
+    count = len(schema)
+    if count == 1:
+        check_item = compile_checker(schema[0])
+        item_types = bulk_item_types(schema[0])
+
+        def check(value):
+            if type(value) not in sequence_types:
+                return False
+            if item_types is not None and set(map(type, value)) <= item_types:
+                return True
+            for item in value:
+                if not check_item(item):
+                    return False
+            return True
+        return check
+    items = [compile_checker(item) for item in schema]
+
+    def check(value):
+        if type(value) not in sequence_types:
+            return False
+        if count and len(value) != count:
+            return False
+        for check_item, item in izip(items, value):
+            if not check_item(item):
+                return False
+        return True
+    return check
+
+
+def _check_mapping(schema):
+    items = [
+        (key, compile_checker(subvalue)) for key, subvalue in schema.items()
+    ]
+
+    def check(value):
+        if type(value) not in map_types:
+            return False
+        for key, check_value in items:
+            if key not in value or not check_value(value[key]):
+                return False
+        return True
+    return check
+
+
+def compile_checker(schema):
+    """Compile the schema definition *schema* into a checker function.
+
+    The checker takes a value and returns True if `Schema.find_errors` would
+    find no errors in it, otherwise False. It applies the same structural
+    rules, but builds no paths or messages and stops at the first error.
+
+    >>> from yape.json_schema.defs import AnyString
+    >>> checker = compile_checker({u"name": AnyString, u"size": [1, 2]})
+    >>> checker({u"name": u"crate", u"size": [1, 2], u"solid": True})
+    True
+    >>> checker({u"name": u"crate", u"size": [1, 2, 3]})
+    False
+    """
+    typ = type(schema)
+    if typ in sequence_types:
+        return _check_sequence(schema)
+    elif typ in map_types:
+        return _check_mapping(schema)
+    elif typ is MetaTokenType:
+        return _check_meta(schema)
+    elif typ in valuetoken_type_map:
+        def check(value):
+            return type(value) in valuetoken_type_map and value == schema
+        return check
+
+    def check(value):
+        return value is schema
+    return check
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
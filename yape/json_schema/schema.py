@@ -1,8 +1,22 @@
 """The actual schema part of `json_schema`."""
 
-from itertools import izip
+from array import array
+from itertools import islice, izip
 
-from yape.json_schema.tokens import token_stream
+from yape.json_schema.compiled import (
+    bulk_item_types, compile_checker, compile_validator, has_predicate,
+    metatoken_matches,
+)
+from yape.json_schema.tokens import (
+    BadInputValue, MetaTokenType, ValueToken, map_types, sequence_types,
+    token_stream, valuetoken_type_map,
+)
+
+# numpy is optional, and only used to convert number arrays in bulk
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 json_types = (
@@ -25,15 +39,177 @@ class UnexpectedToken(SchemaError):
         super(UnexpectedToken, self).__init__(message)
 
 
+def _describe(value):
+    """Describe *value* briefly for an error message."""
+    typ = type(value)
+    if typ in sequence_types:
+        return "an array"
+    elif typ in map_types:
+        return "an object"
+    return repr(value)
+
+
+def _typed_array(value, types):
+    """Convert the numbers in *value*, all of *types*, to a compact array.
+
+    The array is a NumPy array if NumPy is available, otherwise an
+    `array.array`. Return None if *value* isn't all numbers or doesn't fit.
+    """
+    if types <= frozenset((int, long)):
+        typecode, dtype = "l", "int64"
+    elif types <= frozenset((int, long, float)):
+        typecode, dtype = "d", "float64"
+    else:
+        return None
+    try:
+        if numpy is not None:
+            return numpy.array(value, dtype=dtype)
+        return array(typecode, value)
+    except OverflowError:
+        return None
+
+
+def _iter_errors(schema, value, path, typed_arrays=None):
+    """Yield (path, message) for each way *value* differs from *schema*.
+
+    Unlike token comparison, this checks the structure: an object must have
+    every key of the schema, though it may have others, and an array must
+    have as many items as the schema. An array schema with a single item is
+    the schema of every item of the array instead.
+
+    When that item is a metatoken that only checks the type, as for a tile
+    layer of `[AnyInteger]`, the whole array is checked at once by its item
+    types. Such arrays of numbers are also added to *typed_arrays*, if
+    given, converted by `_typed_array` and keyed by their path.
+    """
+    typ = type(schema)
+    if typ in sequence_types:
+        if type(value) not in sequence_types:
+            yield path, "expected an array, got %s" % (_describe(value),)
+        elif len(schema) == 1:
+            item_types = bulk_item_types(schema[0])
+            if item_types is not None:
+                value_types = frozenset(map(type, value)) or item_types
+                if value_types <= item_types:
+                    if typed_arrays is not None:
+                        converted = _typed_array(value, value_types)
+                        if converted is not None:
+                            typed_arrays[path] = converted
+                    return
+            for index, item in enumerate(value):
+                item_path = u"%s[%d]" % (path, index)
+                for error in _iter_errors(schema[0], item, item_path,
+                                          typed_arrays):
+                    yield error
+        elif schema:
+            if len(value) != len(schema):
+                yield path, "expected %d items, got %d" % (
+                    len(schema), len(value)
+                )
+            for index, (subschema, item) in enumerate(izip(schema, value)):
+                item_path = u"%s[%d]" % (path, index)
+                for error in _iter_errors(subschema, item, item_path,
+                                          typed_arrays):
+                    yield error
+    elif typ in map_types:
+        if type(value) not in map_types:
+            yield path, "expected an object, got %s" % (_describe(value),)
+            return
+        for key, subschema in sorted(schema.items()):
+            key_path = u"%s.%s" % (path, key)
+            if key not in value:
+                yield key_path, "missing"
+                continue
+            for error in _iter_errors(subschema, value[key], key_path,
+                                      typed_arrays):
+                yield error
+    elif typ is MetaTokenType:
+        if not metatoken_matches(schema, value):
+            yield path, "expected %s, got %s" % (
+                schema.__name__, _describe(value)
+            )
+    elif typ in valuetoken_type_map:
+        if type(value) not in valuetoken_type_map or value != schema:
+            yield path, "expected %r, got %s" % (schema, _describe(value))
+    elif value is not schema:
+        yield path, "expected %r, got %s" % (schema, _describe(value))
+
+
 class Schema(object):
+    """A schema definition, with two sets of rules for applying it.
+
+    `validate` and `validate_tokens` compare token streams, as
+    `SchemaCollection.match_to_schema` does. Only as much of the two streams
+    as the shorter one holds is compared, so an object with an extra key
+    sorted before the schema's keys fails, while one missing its last keys
+    passes.
+
+    `is_valid` and `find_errors` check the structure instead, as components
+    do: an object must have every key of the schema and may have others,
+    and an array must have as many items as the schema (see `_iter_errors`).
+    `is_valid` is True exactly when `find_errors` finds nothing.
+
+    >>> schema = Schema({u"b": 1})
+    >>> schema.validate({u"a": 0, u"b": 1})[0]
+    False
+    >>> schema.is_valid({u"a": 0, u"b": 1}), schema.find_errors({u"a": 0})
+    (True, [u'$.b: missing'])
+    """
 
     def __init__(self, value):
+        self.definition = value
         self.tokens = list(token_stream(value))
+        self.validator = compile_validator(value)
+        self.checker = compile_checker(value)
+
+    def __reduce__(self):
+        # The compiled functions can't be pickled, so compile them again
+        return Schema, (self.definition,)
 
     def validate(self, value):
-        """Validate *value* against the schema."""
+        """Validate *value* against the schema.
+
+        The compiled validator decides most values without creating any
+        tokens. The tokens are only compared when it can't tell, or to find
+        the tokens that don't match.
+        """
+        if self.validator(value) is True:
+            return True, None, None
         return self.validate_tokens(token_stream(value))
 
+    def is_valid(self, value):
+        """Return whether `find_errors` would find no errors in *value*."""
+        return self.checker(value)
+
+    def find_errors(self, value, max_errors=None, typed_arrays=None):
+        """Return a message for each part of *value* that breaks the schema.
+
+        Each message starts with the JSON path of the part, such as
+        `$.tiles[3].name`. The value is walked once, and the walk stops after
+        *max_errors* errors if given. See `_iter_errors` for how the schema
+        is applied.
+
+        If *typed_arrays* is a dictionary, each valid array of numbers that
+        the schema gives a single item type is added to it as a compact
+        typed array, keyed by its path, so it can go straight into numeric
+        storage.
+
+        >>> from yape.json_schema.defs import AnyString, AnyInteger
+        >>> schema = Schema({u"name": AnyString, u"size": [AnyInteger]})
+        >>> schema.find_errors({u"size": [1, u"2", 3.5]})
+        [u'$.name: missing', u"$.size[1]: expected AnyInteger, got u'2'", u'$.size[2]: expected AnyInteger, got 3.5']
+        >>> schema.find_errors({u"size": [1, u"2", 3.5]}, max_errors=1)
+        [u'$.name: missing']
+        """
+        # Valid values, the usual case, don't need to be walked for errors
+        if typed_arrays is None and self.checker(value):
+            return []
+        errors = _iter_errors(self.definition, value, u"$", typed_arrays)
+        return [
+            u"%s: %s" % (path, message)
+            for path, message in islice(errors, max_errors)
+        ]
+
     def validate_tokens(self, tokens):
         """Validate *tokens* against the schema."""
         for schema_token, real_token in izip(self.tokens, tokens):
@@ -42,6 +218,103 @@ class Schema(object):
         return True, None, None
 
 
+class SchemaIndex(object):
+    """A decision tree that narrows down which schemas a value can match.
+
+    Each node tests the value token at one position of the stream, which is
+    where some of the node's schemas have a value token (a literal, such as a
+    message tag or the first key of a mapping). A schema is only ruled out
+    when comparing its tokens would certainly fail without raising, so the
+    first of the remaining schemas that is valid is the one a scan of every
+    schema would find.
+
+    To guarantee that, a schema is split on its value tokens in stream order,
+    and not on any value token that follows a metatoken with a predicate.
+    Every other kind of token compares without raising, and the value tokens
+    before the split have compared equal to reach this branch.
+
+    >>> schemas = {"move": Schema([u"move", 1]), "quit": Schema([u"quit"]),
+    ...            "any": Schema([None])}
+    >>> index = SchemaIndex(schemas)
+    >>> sorted(index.candidates(list(token_stream([u"quit"]))))
+    ['any', 'quit']
+    """
+
+    __slots__ = ("position", "branches", "rest", "names")
+
+    def __init__(self, schemas, start=0):
+        self.names = list(schemas)
+        self.position = None
+        splits = {}
+        for schema_name, schema in schemas.iteritems():
+            position = self._next_value_position(schema.tokens, start)
+            if position is not None:
+                splits.setdefault(position, []).append(schema_name)
+        if not splits:
+            return
+        # Split on the position shared by the most schemas
+        self.position = max(splits, key=lambda position: len(splits[position]))
+        branches = {}
+        for schema_name in splits[self.position]:
+            token = schemas[schema_name].tokens[self.position]
+            key = (len(list(token)), token.value)
+            branches.setdefault(key, {})[schema_name] = schemas[schema_name]
+        self.branches = dict(
+            (key, SchemaIndex(branch, self.position + 1))
+            for key, branch in branches.items()
+        )
+        self.rest = SchemaIndex(dict(
+            (schema_name, schema)
+            for schema_name, schema in schemas.iteritems()
+            if schema_name not in splits[self.position]
+        ), start)
+
+    @staticmethod
+    def _next_value_position(tokens, start):
+        """Find the first value token of *tokens* from *start* to split on."""
+        for position in xrange(start, len(tokens)):
+            token = tokens[position]
+            if type(token) is MetaTokenType:
+                if has_predicate(token):
+                    return None
+            elif isinstance(token, ValueToken):
+                # Values that aren't equal to themselves can't be looked up
+                if token.value != token.value:
+                    return None
+                return position
+        return None
+
+    def candidates(self, tokens):
+        """Return the names of the schemas that *tokens* might match.
+
+        *tokens* is the list of the value's tokens. It may be a prefix of the
+        stream, as long as it reaches the positions that the index tests.
+        """
+        if self.position is None:
+            return self.names
+        if self.position >= len(tokens):
+            # The stream ends before the position, and so the comparisons
+            # stop before it too
+            return self.names
+        token = tokens[self.position]
+        if not isinstance(token, ValueToken):
+            return self.names
+        names = list(self.rest.candidates(tokens))
+        branch = self.branches.get((len(list(token)), token.value))
+        if branch is not None:
+            names.extend(branch.candidates(tokens))
+        return names
+
+    def depth(self):
+        """Return the highest position that the index may test, or -1."""
+        if self.position is None:
+            return -1
+        return max(
+            [self.position, self.rest.depth()] +
+            [branch.depth() for branch in self.branches.itervalues()]
+        )
+
+
 class SchemaCollectionType(type):
 
     def __new__(self, name, bases, attrs):
@@ -54,6 +327,12 @@ class SchemaCollectionType(type):
         )
         attrs["schemas"] = schemas
         attrs.update(schemas)
+        # Candidates are tried in the order a scan of `schemas` would use
+        attrs["_schema_order"] = dict(
+            (schema_name, order) for order, schema_name in enumerate(schemas)
+        )
+        index = attrs["_schema_index"] = SchemaIndex(schemas)
+        attrs["_schema_index_depth"] = index.depth()
         return super(SchemaCollectionType, self).__new__(self, name, bases, attrs)
 
 
@@ -63,8 +342,26 @@ class SchemaCollection(object):
 
     @classmethod
     def match_to_schema(cls, value):
-        tokens = list(token_stream(value))
-        for schema_name, schema in cls.schemas.iteritems():
-            valid, expected, got = schema.validate_tokens(tokens)
+        stream = token_stream(value)
+        try:
+            # Only as much of the value as the index tests is tokenized
+            tokens = list(islice(stream, cls._schema_index_depth + 1))
+            names = sorted(
+                cls._schema_index.candidates(tokens),
+                key=cls._schema_order.get
+            )
+        except (BadInputValue, TypeError):
+            # Tokenize the whole value, which raises for input token_stream
+            # rejects, and leave the rest to a scan of every schema
+            tokens = list(token_stream(value))
+            names, stream = cls.schemas.keys(), iter(())
+        for schema_name in names:
+            schema = cls.schemas[schema_name]
+            valid = schema.validator(value)
+            if valid is None:
+                # Tokenize the rest of the value once, and only if it's needed
+                tokens.extend(stream)
+                valid, expected, got = schema.validate_tokens(tokens)
             if valid:
                 return schema_name
+
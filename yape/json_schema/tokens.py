@@ -7,7 +7,34 @@ A metatoken (MTK): not really an atom, could be matching anything.
 See the class' individual documentation for more, and a lot of examples.
 """
 
-from yape.types import JSONDict, JSONList
+from yape.types import (
+    FrozenJSONDict, FrozenJSONList, JSONDict, JSONList,
+)
+
+
+# Maps the ID of each interned chain of plain context tokens to the ID of the
+# chain one token longer. The empty chain (no context) has the ID 0.
+_context_paths = {}
+
+# Incremented whenever the context of an existing token is replaced, which
+# invalidates the context path cached by every token
+_context_generation = 0
+
+# Caches whether tokens of each class can be a plain context
+_plain_context_classes = {}
+
+
+def _is_plain_context(context):
+    """Return whether *context* is a token that compares by context alone."""
+    cls = type(context)
+    try:
+        return _plain_context_classes[cls]
+    except KeyError:
+        plain = _plain_context_classes[cls] = (
+            issubclass(cls, Token) and
+            getattr(cls.__eq__, "im_func", None) is Token.__dict__["__eq__"]
+        )
+        return plain
 
 
 class TokenError(Exception):
@@ -66,12 +93,64 @@ class Token(object):
     >>> list(subbar)
     [<Token>]
     """
-    __slots__ = ("context",)
+    __slots__ = ("_context", "_path", "_generation")
 
     def __init__(self, context=None):
-        self.context = context
+        self._context = context
+        self._generation = -1
+
+    def _get_context(self):
+        return self._context
+
+    def _set_context(self, context):
+        global _context_generation
+        self._context = context
+        # Paths cached by this token and its descendants are now stale
+        _context_generation += 1
+
+    context = property(_get_context, _set_context)
+
+    def context_path(self):
+        """Return the interned ID of this token's context chain, or None if
+        the chain holds tokens that compare by more than their context.
+
+        Plain tokens compare equal whenever their contexts do, whatever their
+        classes, so a chain of them is identified by the ID of its parent
+        chain alone, and tokens with equal context chains share one ID.
+        """
+        if self._generation == _context_generation:
+            return self._path
+        context = self._context
+        if context is None:
+            path = 0
+        elif _is_plain_context(context):
+            parent_path = context.context_path()
+            if parent_path is None:
+                path = None
+            else:
+                path = _context_paths.get(parent_path)
+                if path is None:
+                    path = len(_context_paths) + 1
+                    _context_paths[parent_path] = path
+        else:
+            path = None
+        self._path = path
+        self._generation = _context_generation
+        return path
 
     def __eq__(self, other):
+        if isinstance(other, Token):
+            # Inlined context_path() for the common case of cached paths
+            if self._generation == _context_generation:
+                path = self._path
+            else:
+                path = self.context_path()
+            if other._generation == _context_generation:
+                other_path = other._path
+            else:
+                other_path = other.context_path()
+            if path is not None and other_path is not None:
+                return path == other_path
         return hasattr(other, "context") and other.context == self.context
 
     def __ne__(self, other):
@@ -295,9 +374,9 @@ class MetaToken(Token):
     matching_token_types = ()
 
 
-sequence_types = (list, JSONList)
+sequence_types = (list, JSONList, FrozenJSONList)
 
-map_types = (dict, JSONDict)
+map_types = (dict, JSONDict, FrozenJSONDict)
 
 valuetoken_type_map = {
     unicode: StringToken,
@@ -368,14 +447,15 @@ def token_stream(value, context=None):
     elif any([typ is map_type for map_type in map_types]):
         token = MappingToken(context)
         yield token
+        # Every entry shares the same key and value context tokens
+        key_token = MapKeyToken(token)
+        val_token = MapValueToken(token)
         for subkey, subval in sorted(value.items()):
             # Yield keys.
-            key_token = MapKeyToken(token)
             yield key_token
             for subkeytoken in token_stream(subkey, context=key_token):
                 yield subkeytoken
             # Yield values.
-            val_token = MapValueToken(token)
             yield val_token
             for subvaltoken in token_stream(subval, context=val_token):
                 yield subvaltoken
@@ -0,0 +1,344 @@
+"""
+An incremental JSON parser that reads a file in chunks and produces parse
+events, so that huge JSON files can be processed without holding the whole
+text or the whole object tree in memory at once.
+
+Events are (event, value) pairs, where event is one of 'start_map',
+'map_key', 'end_map', 'start_array', 'end_array', 'string', 'number',
+'boolean' or 'null'. For most uses, `iter_items` is simpler: it yields the
+items of one array in the file one at a time, optionally validating each
+against a schema as it goes:
+
+    with open('levels/huge.json', 'rb') as stream:
+        for tile in iter_items(stream, ('tiles',), schema=tile_schema):
+            place(tile)
+"""
+import codecs
+import re
+from json.decoder import scanstring
+
+from yape.types import JSONDict, JSONList
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+NUMBER_RE = re.compile(r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?')
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+LITERALS = {
+    u't': (u'true', 'boolean', True),
+    u'f': (u'false', 'boolean', False),
+    u'n': (u'null', 'null', None),
+}
+
+PUNCTUATION = frozenset(u'{}[]:,')
+
+
+class JSONStreamError(ValueError):
+    """Invalid JSON, or an item that doesn't match its schema"""
+
+    def __init__(self, message, position=None):
+        if position is not None:
+            message = '{0} (char {1})'.format(message, position)
+        super(JSONStreamError, self).__init__(message)
+        self.position = position
+
+
+class InvalidItemError(JSONStreamError):
+    """An item yielded by `iter_items` doesn't match the schema"""
+
+    def __init__(self, path, errors):
+        self.path = path
+        self.errors = errors
+        super(InvalidItemError, self).__init__('; '.join(errors))
+
+
+class _Lexer(object):
+    """
+    Splits the text read from `stream` into JSON tokens, as (kind, value)
+    pairs. Only the unread part of the current chunk is kept in memory, plus
+    a token that spans chunks.
+    """
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        self.pos = 0
+        # The position in the whole text of the start of the buffer
+        self.offset = 0
+        self.eof = False
+
+    @property
+    def position(self):
+        return self.offset + self.pos
+
+    def _fill(self):
+        """
+        Reads another chunk into the buffer, dropping what was consumed.
+        Returns False once the stream is exhausted.
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            chunk = self.decoder.decode(b'', True)
+        elif not isinstance(chunk, unicode):
+            chunk = self.decoder.decode(chunk)
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def tokens(self):
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos == len(self.buffer):
+                if not self._fill():
+                    return
+                continue
+            char = self.buffer[self.pos]
+            if char in PUNCTUATION:
+                self.pos += 1
+                yield char, None
+            elif char == u'"':
+                yield 'string', self._string()
+            elif char in LITERALS:
+                yield self._literal(char)
+            else:
+                yield 'number', self._number()
+
+    def _string(self):
+        while True:
+            try:
+                value, end = scanstring(self.buffer, self.pos + 1)
+            except ValueError as e:
+                # The string, or an escape in it, may continue in the next
+                # chunk
+                truncated = (
+                    'Unterminated' in str(e) or
+                    self.pos + 1 == len(self.buffer) or
+                    len(self.buffer) - self.buffer.rfind(u'\\') <= 6
+                )
+                if truncated and self._fill():
+                    continue
+                raise JSONStreamError(str(e))
+            self.pos = end
+            return value
+
+    def _literal(self, char):
+        literal, kind, value = LITERALS[char]
+        while len(self.buffer) - self.pos < len(literal) and self._fill():
+            pass
+        if self.buffer.startswith(literal, self.pos):
+            self.pos += len(literal)
+            return kind, value
+        raise JSONStreamError('Invalid literal', self.position)
+
+    def _number(self):
+        while True:
+            match = NUMBER_RE.match(self.buffer, self.pos)
+            # A number that reaches the end of the buffer may continue, even
+            # after a trailing '.' or 'e'
+            end = match.end() if match else self.pos
+            if end + 2 >= len(self.buffer) and self._fill():
+                continue
+            break
+        if not match or match.end() == self.pos:
+            raise JSONStreamError('Expecting value', self.position)
+        self.pos = match.end()
+        text = match.group()
+        if match.group(1) or match.group(2):
+            return float(text)
+        return int(text)
+
+
+class JSONEventParser(object):
+    """
+    Iterates over the parse events of the JSON text read from `stream`.
+    `path` is the location of the value of the latest event, as a list of
+    object keys and array indexes.
+    """
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.lexer = _Lexer(stream, chunk_size)
+        self.path = []
+
+    def __iter__(self):
+        return self._events()
+
+    def _error(self, message):
+        return JSONStreamError(message, self.lexer.position)
+
+    def _events(self):
+        path = self.path
+        # The kind of each open container, innermost last
+        stack = []
+        expect = 'value'
+        for kind, value in self.lexer.tokens():
+            if expect == 'value' or expect == 'item_or_end':
+                if kind == ']' and expect == 'item_or_end':
+                    stack.pop()
+                    path.pop()
+                    yield 'end_array', None
+                elif kind in ('string', 'number', 'boolean', 'null'):
+                    if stack and stack[-1] == 'array':
+                        path[-1] += 1
+                    yield kind, value
+                elif kind == '[' or kind == '{':
+                    if stack and stack[-1] == 'array':
+                        path[-1] += 1
+                    if kind == '[':
+                        yield 'start_array', None
+                        stack.append('array')
+                        path.append(-1)
+                        expect = 'item_or_end'
+                    else:
+                        yield 'start_map', None
+                        stack.append('map')
+                        path.append(None)
+                        expect = 'key_or_end'
+                    continue
+                else:
+                    raise self._error('Expecting value')
+            elif expect == 'key' or expect == 'key_or_end':
+                if kind == '}' and expect == 'key_or_end':
+                    stack.pop()
+                    path.pop()
+                    yield 'end_map', None
+                elif kind == 'string':
+                    path[-1] = value
+                    yield 'map_key', value
+                    expect = 'colon'
+                    continue
+                else:
+                    raise self._error('Expecting property name')
+            elif expect == 'colon':
+                if kind != ':':
+                    raise self._error("Expecting ':' delimiter")
+                expect = 'value'
+                continue
+            elif expect == 'comma_or_end':
+                container = stack[-1]
+                if kind == ',':
+                    expect = 'value' if container == 'array' else 'key'
+                    continue
+                elif kind == ']' and container == 'array':
+                    stack.pop()
+                    path.pop()
+                    yield 'end_array', None
+                elif kind == '}' and container == 'map':
+                    stack.pop()
+                    path.pop()
+                    yield 'end_map', None
+                else:
+                    raise self._error("Expecting ',' delimiter")
+            else:
+                raise self._error('Extra data')
+            # A value is complete
+            expect = 'comma_or_end' if stack else 'done'
+        if expect != 'done':
+            raise self._error('Unexpected end of JSON')
+
+
+def iter_events(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the (event, value) parse events of the JSON in `stream`"""
+    return iter(JSONEventParser(stream, chunk_size))
+
+
+def build_value(event, value, events):
+    """
+    Given the first event of a JSON value and an iterator of the events that
+    follow it, consumes the rest of the value's events and returns the value
+    """
+    if event == 'start_map':
+        root = {}
+    elif event == 'start_array':
+        root = []
+    else:
+        return value
+    # Each open container, with the key the next value is stored under
+    stack = [(root, None)]
+    for event, value in events:
+        container, key = stack[-1]
+        if event == 'map_key':
+            stack[-1] = (container, value)
+            continue
+        elif event == 'end_map' or event == 'end_array':
+            stack.pop()
+            if not stack:
+                return root
+            continue
+        elif event == 'start_map':
+            value = {}
+        elif event == 'start_array':
+            value = []
+        if key is None:
+            container.append(value)
+        else:
+            container[key] = value
+        if event == 'start_map' or event == 'start_array':
+            stack.append((value, None))
+    raise JSONStreamError('Unexpected end of JSON')
+
+
+def load(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Parses the JSON in `stream` like `json.load`, but reads it in chunks.
+    Objects and arrays at the top level are returned as a JSONDict or JSONList
+    """
+    events = iter_events(stream, chunk_size)
+    try:
+        event, value = next(events)
+    except StopIteration:
+        raise JSONStreamError('No JSON object could be decoded', 0)
+    value = build_value(event, value, events)
+    # Check that nothing follows the value
+    for _ in events:
+        pass
+    if event == 'start_map':
+        return JSONDict(value)
+    elif event == 'start_array':
+        return JSONList(value)
+    return value
+
+
+def iter_items(stream, path=(), schema=None, max_errors=None,
+        chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields each item of the array at `path` in the JSON in `stream`, where
+    `path` is a sequence of object keys and array indexes from the top level,
+    so only one item is in memory at a time. The rest of the file is not read
+    once the array ends.
+
+    If a `schema` is given, each item is checked with its `find_errors` as it
+    is parsed, and an InvalidItemError carrying up to `max_errors` messages is
+    raised for the first item that doesn't match.
+    """
+    path = list(path)
+    parser = JSONEventParser(stream, chunk_size)
+    events = iter(parser)
+    for event, value in events:
+        if event == 'start_array' and parser.path == path:
+            break
+    else:
+        raise JSONStreamError('No array at {0}'.format(path))
+    for event, value in events:
+        if event == 'end_array':
+            return
+        index = parser.path[-1]
+        item = build_value(event, value, events)
+        if schema is not None:
+            errors = schema.find_errors(item, max_errors)
+            if errors:
+                item_path = u''.join(
+                    u'[{0}]'.format(part) if isinstance(part, int)
+                    else u'.{0}'.format(part)
+                    for part in path + [index]
+                )
+                raise InvalidItemError(item_path, [
+                    u'$' + item_path + error[1:] for error in errors
+                ])
+        yield item
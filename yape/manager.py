@@ -1,8 +1,13 @@
 import os
 import json
+import marshal
+from multiprocessing import Pool
 from weakref import WeakValueDictionary
 
-from yape.types import JSONDict, JSONList
+from yape.fsm import FSMDefinition
+from yape import json_stream
+from yape.types import JSONDict, JSONList, FrozenJSONDict, FrozenJSONList
+from yape.json_schema import Schema, AnyString
 
 import pygame
 
@@ -74,6 +79,42 @@ class SpriteManager(GenericAssetManager):
         return image
 
 
+def _load_json_file(args):
+    """
+    Reads, parses and validates one JSON file for JSONManager.load_many in a
+    worker process. Returns the parsed data in marshal format, which is much
+    quicker to send back than a pickle, or None and the error message.
+    """
+    full_filename, schema = args
+    try:
+        with open(full_filename) as f:
+            contents = f.read()
+    except IOError:
+        return None, 'Could not open JSON file {0}'.format(full_filename)
+    try:
+        json_data = json.loads(contents)
+    except ValueError as e:
+        return None, 'Invalid JSON in file {0}. {1}'.format(full_filename, e)
+    error = _find_schema_error(full_filename, json_data, schema)
+    if error is not None:
+        return None, error
+    return marshal.dumps(json_data), None
+
+
+def _find_schema_error(full_filename, json_data, schema):
+    """
+    Returns the message describing why the data from a JSON file doesn't
+    match the `schema`, or None if it matches or there is no schema
+    """
+    if schema is None:
+        return None
+    errors = schema.find_errors(json_data)
+    if errors:
+        err_msg = u'Invalid data in file {0}. {1}'
+        return err_msg.format(full_filename, u'; '.join(errors))
+    return None
+
+
 class JSONManager(GenericAssetManager):
 
     def _load_file_data(self, filename):
@@ -91,12 +132,169 @@ class JSONManager(GenericAssetManager):
         if file_contents is None:
             return None
         try:
-            json_data = json.loads(file_contents)
+            # Objects are frozen as they are parsed, rather than copied after
+            json_data = json.loads(file_contents, object_hook=FrozenJSONDict)
         except ValueError as e:
             print 'Invalid JSON in file {0}. {1}'.format(full_filename, e)
             return None
-        kls = JSONDict if isinstance(json_data, dict) else JSONList
-        return kls(json_data)
+        if isinstance(json_data, FrozenJSONDict):
+            return json_data
+        return FrozenJSONList(json_data)
+
+    def load_many(self, filenames, schema=None, processes=None):
+        """
+        Reads, parses and validates (against the `schema`, if given) each of
+        the JSON files in `filenames` in parallel across a pool of
+        `processes` worker processes (by default one per CPU). Returns a
+        dictionary of each filename to its data, or None if the file is
+        missing or invalid, after printing why. The data is cached, so `get`
+        returns it afterwards, and files that are already cached are not
+        loaded again.
+        """
+        results = {}
+        pending = []
+        for filename in filenames:
+            asset = self.cache.get((filename,))
+            if asset is not None:
+                error = _find_schema_error(
+                    os.path.join(self.path, filename), asset, schema
+                )
+                if error is not None:
+                    print error
+                    asset = None
+                results[filename] = asset
+            elif filename not in pending:
+                pending.append(filename)
+        tasks = [
+            (os.path.join(self.path, filename), schema) for filename in pending
+        ]
+        if len(tasks) > 1 and processes != 1:
+            pool = Pool(processes)
+            try:
+                loaded = pool.map(_load_json_file, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            loaded = map(_load_json_file, tasks)
+        for filename, (marshalled, error) in zip(pending, loaded):
+            if error is not None:
+                print error
+                results[filename] = None
+                continue
+            json_data = marshal.loads(marshalled)
+            if isinstance(json_data, dict):
+                asset = FrozenJSONDict(json_data)
+            else:
+                asset = FrozenJSONList(json_data)
+            results[filename] = asset
+            self.cache[(filename,)] = asset
+        return results
+
+    def iter_items(self, filename, path=(), schema=None):
+        """
+        Yields each item of the array at `path` in a JSON file, parsing the
+        file incrementally so that huge files never have to be held in memory
+        at once. Items are checked against the `schema`, if given, as they are
+        parsed. Stops after printing the error if the file can't be read or an
+        item is invalid. The items are not cached.
+        """
+        full_filename = os.path.join(self.path, filename)
+        try:
+            f = open(full_filename, 'rb')
+        except IOError:
+            print 'Could not open JSON file {0}'.format(full_filename)
+            return
+        with f:
+            try:
+                for item in json_stream.iter_items(f, path, schema=schema):
+                    yield item
+            except json_stream.JSONStreamError as e:
+                print 'Invalid JSON in file {0}. {1}'.format(full_filename, e)
+
+
+class FSMManager(GenericAssetManager):
+    """
+    Loads state machine definitions from JSON files in the format:
+
+        {
+            "initial": "idle",
+            "transitions": [
+                {"name": "alert", "source": "idle", "destination": "chase"},
+                ...
+            ],
+            "final": ["dead"]
+        }
+
+    Each file is validated and compiled into an FSMDefinition once, which is
+    then cached like any other asset. Definitions with states that can not be
+    reached from the initial state, or that have states without transitions
+    out of them that aren't listed in the optional "final" list, are invalid.
+    """
+
+    state_schema = Schema(AnyString)
+    transition_schema = Schema({
+        u'destination': AnyString,
+        u'name': AnyString,
+        u'source': AnyString,
+    })
+
+    def __init__(self, json_manager):
+        super(FSMManager, self).__init__(json_manager.path)
+        self.json_manager = json_manager
+
+    def find_errors(self, data):
+        """
+        Returns a list of the ways the JSON `data` does not describe a state
+        machine
+        """
+        if not isinstance(data, dict):
+            return ['A state machine must be a JSON object']
+        errors = []
+        if not self.state_schema.is_valid(data.get('initial')):
+            errors.append('initial must be a state name')
+        transitions = data.get('transitions')
+        if not isinstance(transitions, list):
+            errors.append('transitions must be a list')
+        else:
+            for index, transition in enumerate(transitions):
+                # find_errors requires every key, while ignoring extra ones
+                if self.transition_schema.find_errors(transition, 1):
+                    err_msg = 'transition {0} must have a name, source and destination'
+                    errors.append(err_msg.format(index))
+        final = data.get('final', [])
+        if not isinstance(final, list) or not all(
+            self.state_schema.is_valid(state) for state in final
+        ):
+            errors.append('final must be a list of state names')
+        return errors
+
+    def load(self, filename):
+        data = self.json_manager.get(filename)
+        if data is None:
+            return None
+        errors = self.find_errors(data)
+        if not errors:
+            definition = FSMDefinition(
+                data['transitions'], initial=data['initial']
+            )
+            if definition.unreachable_states:
+                errors.append('unreachable states: {0}'.format(
+                    ', '.join(sorted(definition.unreachable_states))
+                ))
+            dead_states = definition.dead_states.difference(
+                data.get('final', [])
+            )
+            if dead_states:
+                errors.append('states without transitions: {0}'.format(
+                    ', '.join(sorted(dead_states))
+                ))
+        if errors:
+            print 'Invalid state machine in file {0}. {1}'.format(
+                filename, '; '.join(errors)
+            )
+            return None
+        return definition
 
 
 class Manager(object):
@@ -114,11 +312,27 @@ class Manager(object):
         self._image_manager = ImageManager(images_dir)
         self._sprite_manager = SpriteManager(images_dir)
         self._font_manager = FontManager(fonts_dir)
+        self._fsm_manager = FSMManager(self._json_manager)
 
     def get_json(self, sub_path, filename):
         filename = os.path.join(sub_path, filename)
         return self._json_manager.get(filename)
 
+    def load_json_many(self, sub_path, filenames, schema=None, processes=None):
+        paths = [os.path.join(sub_path, filename) for filename in filenames]
+        loaded = self._json_manager.load_many(paths, schema, processes)
+        return dict(
+            (filename, loaded[path]) for filename, path in zip(filenames, paths)
+        )
+
+    def iter_json_items(self, sub_path, filename, path=(), schema=None):
+        filename = os.path.join(sub_path, filename)
+        return self._json_manager.iter_items(filename, path, schema)
+
+    def get_fsm(self, sub_path, filename):
+        filename = os.path.join(sub_path, filename)
+        return self._fsm_manager.get(filename)
+
     def get_image(self, filename):
         return self._image_manager.get(filename)
 
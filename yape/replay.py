@@ -0,0 +1,131 @@
+import marshal
+import struct
+
+import pygame
+
+
+# Every log starts with a magic string and a format version so that stale or
+# unrelated files are rejected rather than replayed as garbage
+LOG_HEADER = b'YAPEREC' + struct.pack('<B', 1)
+FRAME_FORMAT = struct.Struct('<I')
+EVENT_FORMAT = struct.Struct('<IH')
+MARSHAL_VERSION = 2
+
+
+class ReplayError(Exception):
+    pass
+
+
+def encode_event_attributes(attributes):
+    """
+    Given the attribute dictionary of a pygame event, return a compact binary
+    representation of it. Attributes whose values can not be serialized are
+    dropped, since they can not be reproduced on replay anyway.
+    """
+    if not attributes:
+        return b''
+    try:
+        return marshal.dumps(attributes, MARSHAL_VERSION)
+    except ValueError:
+        serializable = {}
+        for key, value in attributes.items():
+            try:
+                marshal.dumps(value, MARSHAL_VERSION)
+            except ValueError:
+                continue
+            serializable[key] = value
+        return marshal.dumps(serializable, MARSHAL_VERSION)
+
+
+def decode_event_attributes(payload):
+    """Inverse of `encode_event_attributes`"""
+    if not payload:
+        return {}
+    return marshal.loads(payload)
+
+
+class EventRecorder(object):
+    """
+    An event queue that wraps another event queue (such as
+    `get_pygame_event_queue`) and writes every frame's events to a binary
+    `stream` before handing them on. Frames without events are recorded too, so
+    that a replay stays aligned frame by frame with the original session.
+
+    Use it in place of the wrapped queue when creating a Dispatcher:
+
+        recorder = EventRecorder(get_pygame_event_queue, open(path, 'wb'))
+        dispatcher = Dispatcher(recorder)
+    """
+
+    def __init__(self, event_queue, stream):
+        self.event_queue = event_queue
+        self.stream = stream
+        self.frame_count = 0
+        self.stream.write(LOG_HEADER)
+
+    def __call__(self):
+        events = list(self.event_queue())
+        chunks = [FRAME_FORMAT.pack(len(events))]
+        for event in events:
+            payload = encode_event_attributes(getattr(event, 'dict', None))
+            chunks.append(EVENT_FORMAT.pack(event.type, len(payload)))
+            chunks.append(payload)
+        self.stream.write(b''.join(chunks))
+        self.frame_count += 1
+        return events
+
+    def close(self):
+        self.stream.close()
+
+
+class EventReplay(object):
+    """
+    An event queue that reads a log written by EventRecorder and returns one
+    recorded frame of events per call. Once the log is exhausted, `finished` is
+    set and every further call returns an empty list.
+
+    Since it never waits on the clock or the display, a Dispatcher that uses it
+    can drive a headless game loop as fast as the game logic allows.
+    """
+
+    def __init__(self, stream, event_factory=pygame.event.Event):
+        self.stream = stream
+        self.event_factory = event_factory
+        self.frame_count = 0
+        self.finished = False
+        header = stream.read(len(LOG_HEADER))
+        if header != LOG_HEADER:
+            raise ReplayError('Not an event log or unsupported log version')
+
+    def _read(self, size):
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise ReplayError(
+                'Event log truncated in frame {0}'.format(self.frame_count)
+            )
+        return data
+
+    def __call__(self):
+        if self.finished:
+            return []
+        frame_header = self.stream.read(FRAME_FORMAT.size)
+        if not frame_header:
+            self.finished = True
+            return []
+        if len(frame_header) != FRAME_FORMAT.size:
+            raise ReplayError(
+                'Event log truncated in frame {0}'.format(self.frame_count)
+            )
+        event_count, = FRAME_FORMAT.unpack(frame_header)
+        events = []
+        for _ in xrange(event_count):
+            event_type, payload_size = EVENT_FORMAT.unpack(
+                self._read(EVENT_FORMAT.size)
+            )
+            attributes = decode_event_attributes(self._read(payload_size))
+            events.append(self.event_factory(event_type, attributes))
+        self.frame_count += 1
+        return events
+
+    def close(self):
+        self.stream.close()
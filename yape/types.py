@@ -13,3 +13,103 @@ class JSONList(list):
     def __init__(self, json_data):
         self.extend(json_data)
 
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('Frozen JSON data can not be changed, thaw() it first')
+
+
+def _all_frozen(values):
+    """
+    Returns whether none of the `values` need freezing, checking their types
+    without a Python call for each value
+    """
+    return _frozen_types.issuperset(map(type, values))
+
+
+def freeze(value):
+    """
+    Returns `value` with each dictionary and list in it replaced by a frozen
+    copy, so that it can be shared without defensive copies
+    """
+    if isinstance(value, (FrozenJSONDict, FrozenJSONList)):
+        return value
+    elif isinstance(value, dict):
+        return FrozenJSONDict(value)
+    elif isinstance(value, list):
+        return FrozenJSONList(value)
+    return value
+
+
+class FrozenJSONDict(JSONDict):
+    """
+    A JSONDict that can not be changed, and whose dictionaries and lists are
+    frozen too. Copying one returns it as it is. `thaw` returns a copy that
+    can be changed, while its values stay frozen and shared, so only the
+    parts of the data that are changed are ever copied:
+
+        level = manager.get_json('levels', 'level_1.json')
+        changed = level.thaw()
+        changed['player'] = level['player'].thaw()
+        changed['player']['x'] = 10
+    """
+
+    def __init__(self, json_data):
+        dict.update(self, json_data)
+        # Most dictionaries hold only scalars, so only look at each value
+        # when some of them are containers
+        if not _all_frozen(self.itervalues()):
+            for key, value in self.items():
+                if type(value) not in _frozen_types:
+                    dict.__setitem__(self, key, freeze(value))
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenJSONDict, (dict(self),)
+
+    def thaw(self):
+        """Returns a JSONDict with the same, still frozen, values"""
+        return JSONDict(self)
+
+
+class FrozenJSONList(JSONList):
+    """
+    A JSONList that can not be changed, and whose dictionaries and lists are
+    frozen too. See FrozenJSONDict.
+    """
+
+    def __init__(self, json_data):
+        list.extend(self, json_data)
+        if not _all_frozen(self):
+            list.__setslice__(self, 0, len(self), map(freeze, self))
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenJSONList, (list(self),)
+
+    def thaw(self):
+        """Returns a JSONList with the same, still frozen, items"""
+        return JSONList(self)
+
+
+# The types of values that never need freezing
+_frozen_types = frozenset([
+    FrozenJSONDict, FrozenJSONList, unicode, str, int, long, float, bool,
+    type(None),
+])
@@ -14,7 +14,8 @@ def is_non_string_iterable(item):
 def validate_data_against_schema(data, schema):
     """
     Given `data`, and a `schema`, returns True if the data conforms to the
-    schema provided; otherwise returns False
+    schema provided; otherwise returns False. To validate a lot of data
+    against one schema, use `compile_schema` instead.
     """
     # Dictionaries
     if hasattr(schema, 'keys'):
@@ -40,6 +41,100 @@ def validate_data_against_schema(data, schema):
     return True
 
 
+# Whether values of each type are non-string iterables
+_non_string_iterable_types = {}
+
+
+def _is_non_string_iterable(item):
+    """
+    is_non_string_iterable, remembering the answer for the type of the item
+    """
+    typ = type(item)
+    try:
+        return _non_string_iterable_types[typ]
+    except KeyError:
+        result = is_non_string_iterable(item)
+        # Instances of old-style classes all share one type
+        if getattr(item, '__class__', None) is typ:
+            _non_string_iterable_types[typ] = result
+        return result
+
+
+def _compile_node(schema):
+    """
+    Returns a function that validates data against `schema` exactly as
+    validate_data_against_schema does, with the kind of each part of the
+    schema worked out in advance
+    """
+    # Dictionaries
+    if hasattr(schema, 'keys'):
+        items = [(key, _compile_node(schema[key])) for key in schema]
+
+        def validate(data):
+            for key, validate_value in items:
+                if not key in data:
+                    return False
+                if not validate_value(data[key]):
+                    return False
+            return True
+    # List
+    elif is_non_string_iterable(schema):
+        keys = [_compile_node(key) for key in schema]
+
+        def validate(data):
+            if _is_non_string_iterable(data) and not hasattr(data, 'keys'):
+                for value in data:
+                    if not validate(value):
+                        return False
+            else:
+                for validate_key in keys:
+                    if not validate_key(data):
+                        return False
+            return True
+    # Everything else, probably strings and numbers
+    else:
+        def validate(data):
+            return schema in data
+    return validate
+
+
+class CompiledSchema(object):
+    """
+    A schema in the format of validate_data_against_schema, compiled once so
+    that it can validate any amount of data without being interpreted again:
+
+        is_enemy = compile_schema({'name': 'enemy', 'sprite': ['path']})
+        results = is_enemy.validate_many(templates)
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._validate = _compile_node(schema)
+
+    def __call__(self, data):
+        return self._validate(data)
+
+    def validate(self, data):
+        """
+        Returns True if `data` conforms to the schema; otherwise returns False
+        """
+        return self._validate(data)
+
+    def validate_many(self, data_list):
+        """Returns a list of whether each of the given data is valid"""
+        validate = self._validate
+        return [validate(data) for data in data_list]
+
+
+def compile_schema(schema):
+    """
+    Given a `schema` in the format validate_data_against_schema takes,
+    returns a CompiledSchema that validates data against it with the same
+    results
+    """
+    return CompiledSchema(schema)
+
+
 def word_wrap(sentence, limit, hyphenate=True):
     """
     A simple word wrap utility function.